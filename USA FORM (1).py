@@ -4,49 +4,22 @@ import hashlib
 from datetime import datetime, time, timedelta
 import os
 import re
+import sys
 from PIL import Image
 import io
+import csv
 import pandas as pd
 import json
 import pytz
-
-# Ensure 'data' directory exists before any DB connection
-os.makedirs("data", exist_ok=True)
-
-# --- Ensure DB migration for break_templates column ---
-def ensure_break_templates_column():
-    conn = sqlite3.connect("data/requests.db")
-    try:
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA table_info(users)")
-        columns = [row[1] for row in cursor.fetchall()]
-        if "break_templates" not in columns:
-            try:
-                cursor.execute("ALTER TABLE users ADD COLUMN break_templates TEXT")
-                conn.commit()
-            except Exception:
-                pass
-    finally:
-        conn.close()
-
-ensure_break_templates_column()
-
-def ensure_group_messages_reactions_column():
-    conn = sqlite3.connect("data/requests.db")
-    try:
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA table_info(group_messages)")
-        columns = [row[1] for row in cursor.fetchall()]
-        if "reactions" not in columns:
-            try:
-                cursor.execute("ALTER TABLE group_messages ADD COLUMN reactions TEXT DEFAULT '{}' ")
-                conn.commit()
-            except Exception:
-                pass
-    finally:
-        conn.close()
-
-ensure_group_messages_reactions_column()
+import threading
+import atexit
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+import heapq
+from itertools import islice
+from operator import attrgetter
+from contextlib import contextmanager
+from time import monotonic, sleep
 
 # --------------------------
 # Timezone Utility Functions
@@ -66,6 +39,18 @@ def convert_to_casablanca_date(date_str):
     except:
         return None
 
+def casablanca_to_epoch(timestamp):
+    """UTC epoch seconds for a stored "%Y-%m-%d %H:%M:%S" Casablanca time string."""
+    dt = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
+    return int(pytz.timezone('Africa/Casablanca').localize(dt).timestamp())
+
+def casablanca_day_epochs(start_date, end_date=None):
+    """[start, end) epoch bounds covering whole Casablanca days start_date..end_date."""
+    morocco_tz = pytz.timezone('Africa/Casablanca')
+    start = morocco_tz.localize(datetime.combine(start_date, time.min))
+    end = morocco_tz.localize(datetime.combine(end_date or start_date, time.min) + timedelta(days=1))
+    return int(start.timestamp()), int(end.timestamp())
+
 def get_date_range_casablanca(date):
     """Get start and end of day in Casablanca time"""
     try:
@@ -80,485 +65,2133 @@ def get_date_range_casablanca(date):
 # Database Functions
 # --------------------------
 
+DB_PATH = os.path.join("data", "requests.db")
+DB_CACHED_STATEMENTS = 256
+# Storage mode: WAL lets readers run alongside the (single) active writer.
+# Set LYCA_DB_JOURNAL_MODE=DELETE to fall back to the rollback journal.
+DB_JOURNAL_MODE = os.environ.get("LYCA_DB_JOURNAL_MODE", "WAL").upper()
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("LYCA_DB_BUSY_TIMEOUT_MS", "5000"))
+DB_WRITE_RETRIES = 3
+DB_LOCK_WAIT_THRESHOLD_MS = 5
+WAL_CHECKPOINT_INTERVAL_SECONDS = int(os.environ.get("LYCA_WAL_CHECKPOINT_INTERVAL", "30"))
+WAL_TRUNCATE_BYTES = 16 * 1024 * 1024
+
+def is_lock_error(error):
+    """True for SQLITE_BUSY/SQLITE_LOCKED errors raised by the sqlite3 module."""
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+class WalCheckpointer(threading.Thread):
+    """Background thread keeping the WAL file bounded.
+
+    Writers run with wal_autocheckpoint disabled so no request pays for a
+    checkpoint; this thread runs a PASSIVE checkpoint every interval and a
+    TRUNCATE checkpoint once the WAL grows past WAL_TRUNCATE_BYTES.
+    """
+
+    def __init__(self, path, interval=WAL_CHECKPOINT_INTERVAL_SECONDS):
+        super().__init__(name="wal-checkpointer", daemon=True)
+        self.path = path
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self.runs = 0
+        self.truncations = 0
+        self.last_run = None
+        self.last_result = None  # (busy, wal frames, checkpointed frames)
+
+    def wal_size(self):
+        try:
+            return os.path.getsize(self.path + "-wal")
+        except OSError:
+            return 0
+
+    def checkpoint(self, conn):
+        mode = "TRUNCATE" if self.wal_size() > WAL_TRUNCATE_BYTES else "PASSIVE"
+        self.last_result = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        self.last_run = get_casablanca_time()
+        self.runs += 1
+        if mode == "TRUNCATE":
+            self.truncations += 1
+
+    def run(self):
+        conn = sqlite3.connect(self.path, timeout=DB_BUSY_TIMEOUT_MS / 1000)
+        try:
+            while not self._stop_event.wait(self.interval):
+                try:
+                    self.checkpoint(conn)
+                except sqlite3.Error:
+                    pass  # Retried on the next tick
+        finally:
+            conn.close()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stats(self):
+        return {
+            "wal_bytes": self.wal_size(),
+            "runs": self.runs,
+            "truncations": self.truncations,
+            "last_run": self.last_run,
+            "last_result": self.last_result,
+        }
+
+class ConnectionPool:
+    """Process-wide pool of long-lived SQLite connections, one per thread.
+
+    Streamlit runs every rerun on a fresh script thread, so connections owned
+    by finished threads are recycled to the next thread instead of closed.
+    """
+
+    def __init__(self, path, journal_mode=DB_JOURNAL_MODE, read_only=False):
+        self.path = path
+        self.journal_mode = journal_mode
+        self.read_only = read_only
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._owned = {}  # thread -> connection
+        self._idle = []
+        self.opened = 0
+        self.reused = 0
+        self.closed = False
+        self.contention = {}  # table -> write lock counters
+        self.checkpointer = None
+        if journal_mode == "WAL" and not read_only:
+            self._connect().close()  # Switch the file to WAL before anyone reads it
+            self.checkpointer = WalCheckpointer(path)
+            self.checkpointer.start()
+        atexit.register(self.close_all)
+
+    def _connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(
+            self.path,
+            isolation_level=None,  # transactions are opened explicitly
+            check_same_thread=False,
+            cached_statements=DB_CACHED_STATEMENTS,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        )
+        conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        if self.journal_mode == "WAL":
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA wal_autocheckpoint=0")
+        if self.read_only:
+            conn.execute("PRAGMA query_only=ON")
+        self.opened += 1
+        return conn
+
+    def _reap(self):
+        """Move connections of finished threads back to the idle list."""
+        for thread in [t for t in self._owned if not t.is_alive()]:
+            self._idle.append(self._owned.pop(thread))
+
+    def connection(self):
+        """Return the calling thread's connection, opening one if needed."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        with self._lock:
+            if self.closed:
+                raise sqlite3.ProgrammingError("Connection pool has been shut down")
+            self._reap()
+            if self._idle:
+                conn = self._idle.pop()
+                self.reused += 1
+            else:
+                conn = self._connect()
+            self._owned[threading.current_thread()] = conn
+        self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self, table="other"):
+        """Run a block in one write transaction; nested blocks join the outer one."""
+        conn = self.connection()
+        if conn.in_transaction:
+            yield conn
+            return
+        self._begin_immediate(conn, table)
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+
+    def _begin_immediate(self, conn, table):
+        """Take the write lock up front so concurrent writers queue on the
+        busy timeout instead of failing mid-transaction; retry with backoff
+        if the timeout itself expires."""
+        started = monotonic()
+        retries = 0
+        while True:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                break
+            except sqlite3.OperationalError as e:
+                if not is_lock_error(e) or retries >= DB_WRITE_RETRIES:
+                    self._record_contention(table, started, retries, failed=True)
+                    raise
+                retries += 1
+                sleep(0.05 * 2 ** retries)
+        self._record_contention(table, started, retries)
+
+    def _record_contention(self, table, started, retries, failed=False):
+        waited_ms = (monotonic() - started) * 1000
+        with self._lock:
+            entry = self.contention.setdefault(table, {
+                "transactions": 0, "lock_waits": 0, "wait_ms": 0.0,
+                "max_wait_ms": 0.0, "retries": 0, "failures": 0,
+            })
+            entry["transactions"] += 1
+            entry["retries"] += retries
+            if waited_ms >= DB_LOCK_WAIT_THRESHOLD_MS:
+                entry["lock_waits"] += 1
+                entry["wait_ms"] += waited_ms
+                entry["max_wait_ms"] = max(entry["max_wait_ms"], waited_ms)
+            if failed:
+                entry["failures"] += 1
+
+    def contention_stats(self):
+        with self._lock:
+            return {table: dict(entry) for table, entry in self.contention.items()}
+
+    def stats(self):
+        with self._lock:
+            self._reap()
+            return {
+                "open": len(self._owned) + len(self._idle),
+                "in_use": len(self._owned),
+                "idle": len(self._idle),
+                "opened": self.opened,
+                "reused": self.reused,
+            }
+
+    def close_all(self):
+        """Close every pooled connection; called on interpreter shutdown."""
+        if self.checkpointer is not None:
+            self.checkpointer.stop()
+        with self._lock:
+            self.closed = True
+            for conn in list(self._owned.values()) + self._idle:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._owned.clear()
+            self._idle.clear()
+
+@st.cache_resource
+def get_connection_pool(path=DB_PATH):
+    """Shared connection pool, kept alive across reruns and sessions."""
+    return ConnectionPool(path)
+
+def current_pool():
+    """Pool serving this thread: background workers carry their own on the
+    thread object (db_pool), everything else uses the shared pool."""
+    return getattr(threading.current_thread(), "db_pool", None) or get_connection_pool()
+
 def get_db_connection():
-    """Create and return a database connection."""
-    os.makedirs("data", exist_ok=True)
-    return sqlite3.connect("data/requests.db")
+    """Return this thread's pooled database connection (do not close it)."""
+    return current_pool().connection()
+
+def db_transaction(table="other"):
+    """Context manager committing all statements of the block at once.
+
+    `table` labels the transaction in the write-contention statistics.
+    """
+    return current_pool().transaction(table)
+
+WRITE_QUEUE_MAX_BATCH = 200
+# How long the writer lingers for more work before committing a batch.
+WRITE_QUEUE_LINGER_SECONDS = float(os.environ.get("LYCA_WRITE_QUEUE_LINGER", "0.005"))
+WRITE_QUEUE_ACK_TIMEOUT_SECONDS = 30
+
+class WriteQueue(threading.Thread):
+    """Single writer thread that group-commits queued writes.
+
+    Callers submit `func(conn, *args)` and get a Future back. The writer
+    drains whatever is pending into one transaction, running each write in
+    its own savepoint so a failing write does not sink the rest of the
+    batch. Futures resolve with the write's return value only after the
+    batch has committed, i.e. once the row is durable: the writer's own
+    connection runs with synchronous=FULL, so every group commit fsyncs the
+    WAL (one fsync per batch rather than per write).
+    """
+
+    def __init__(self, pool, max_batch=WRITE_QUEUE_MAX_BATCH, linger=WRITE_QUEUE_LINGER_SECONDS):
+        super().__init__(name="db-writer", daemon=True)
+        self.pool = pool
+        self.max_batch = max_batch
+        self.linger = linger
+        self._queue = queue.Queue()
+        self._stopping = False
+        self.batches = 0
+        self.writes = 0
+        self.failures = 0
+        self.largest_batch = 0
+        self.last_error = None
+
+    def submit(self, table, func, *args):
+        future = Future()
+        if self._stopping:
+            future.set_exception(sqlite3.ProgrammingError("Write queue has been shut down"))
+        else:
+            self._queue.put((table, func, args, future))
+        return future
+
+    def run(self):
+        # Pool connections use synchronous=NORMAL under WAL, which may lose
+        # the last commits on power failure; the writer acknowledges writes
+        # as committed, so its connection must sync on every commit.
+        self.pool.connection().execute("PRAGMA synchronous=FULL")
+        while True:
+            op = self._queue.get()
+            if op is None:
+                return
+            batch = [op]
+            deadline = monotonic() + self.linger
+            while len(batch) < self.max_batch:
+                try:
+                    op = self._queue.get(timeout=max(0.0, deadline - monotonic()))
+                except queue.Empty:
+                    break
+                if op is None:
+                    self._queue.put(None)  # Stop after this batch
+                    break
+                batch.append(op)
+            self._commit(batch)
+
+    def _commit(self, batch):
+        batch = [op for op in batch if op[3].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        label = batch[0][0] if len({op[0] for op in batch}) == 1 else "write_queue"
+        outcomes = []
+        try:
+            with self.pool.transaction(label) as conn:
+                for table, func, args, future in batch:
+                    conn.execute("SAVEPOINT queued_write")
+                    try:
+                        result = func(conn, *args)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO queued_write")
+                        outcomes.append((future, None, e))
+                    else:
+                        outcomes.append((future, result, None))
+                    conn.execute("RELEASE queued_write")
+        except Exception as e:
+            outcomes = [(future, None, e) for _, _, _, future in batch]
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(batch))
+        for future, result, error in outcomes:
+            if error is None:
+                self.writes += 1
+                future.set_result(result)
+            else:
+                self.failures += 1
+                self.last_error = f"{type(error).__name__}: {error}"
+                future.set_exception(error)
+
+    def stop(self):
+        """Flush pending writes and stop; called on interpreter shutdown."""
+        self._stopping = True
+        self._queue.put(None)
+        self.join(timeout=WRITE_QUEUE_ACK_TIMEOUT_SECONDS)
+
+    def stats(self):
+        return {
+            "pending": self._queue.qsize(),
+            "batches": self.batches,
+            "writes": self.writes,
+            "failures": self.failures,
+            "avg_batch": round(self.writes / self.batches, 1) if self.batches else 0,
+            "largest_batch": self.largest_batch,
+            "last_error": self.last_error,
+        }
+
+@st.cache_resource
+def get_write_queue():
+    """Process-wide writer; registered after the pool so it flushes first at exit."""
+    writer = WriteQueue(get_connection_pool())
+    writer.start()
+    atexit.register(writer.stop)
+    return writer
+
+def queue_write(table, func, *args, wait=True, writer=None):
+    """Hand a write to the writer thread (or the given shard writer).
+
+    With wait=True block until the batch holding it has committed and
+    return func's result; with wait=False return the Future immediately
+    (fire-and-forget callers can ignore it).
+    """
+    future = (writer or get_write_queue()).submit(table, func, *args)
+    if wait:
+        return future.result(timeout=WRITE_QUEUE_ACK_TIMEOUT_SECONDS)
+    return future
+
+# Live updates. Write functions publish an event on a (topic, group) once
+# their write has committed; every session runs a small fragment that
+# checks the hub for its subscriptions and reruns the page only when one
+# of them moved. The hub lives in this process: writes made elsewhere
+# (the CLI, another server) are only seen by the slow fallback rerun.
+
+LIVE_POLL_SECONDS = float(os.environ.get("LYCA_LIVE_POLL_SECONDS", "2"))
+LIVE_FALLBACK_SECONDS = float(os.environ.get("LYCA_LIVE_FALLBACK_SECONDS", "300"))
+ALL_GROUPS = "*"
+
+class EventHub:
+    """In-process publish/subscribe of change events.
+
+    Events carry no payload: the hub keeps, per (topic, group), the
+    sequence number of the latest event, and a session compares those
+    with the sequence it last rendered at. group None means the event's
+    group is unknown (e.g. a status change by id) and reaches every
+    subscriber of the topic.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest = {}
+        self.seq = 0
+
+    def publish(self, topic, group_name=None):
+        with self._lock:
+            self.seq += 1
+            self._latest[(topic, group_name)] = self._latest[(topic, ALL_GROUPS)] = self.seq
+            return self.seq
+
+    def changed(self, subscriptions, since):
+        """True if any (topic, group) subscription has an event after `since`.
+
+        Subscribing with group None follows the topic in every group.
+        """
+        latest = self._latest
+        for topic, group_name in subscriptions:
+            if group_name is None:
+                if latest.get((topic, ALL_GROUPS), 0) > since:
+                    return True
+            elif max(latest.get((topic, group_name), 0), latest.get((topic, None), 0)) > since:
+                return True
+        return False
+
+@st.cache_resource
+def get_event_hub():
+    return EventHub()
+
+def publish_event(topic, group_name=None, result=True):
+    """Publish once the write behind `result` has committed; returns `result`.
+
+    `result` is a write's return value (nothing is published for False)
+    or the Future of a queued write, published when it succeeds.
+    """
+    hub = get_event_hub()
+    if isinstance(result, Future):
+        result.add_done_callback(lambda future: future.exception() is None and hub.publish(topic, group_name))
+    elif result is not False:
+        hub.publish(topic, group_name)
+    return result
+
+DB_READ_WORKERS = int(os.environ.get("LYCA_DB_READ_WORKERS", "4"))
+
+def reader_executor(pool, name):
+    """Thread pool whose workers read through `pool` instead of the shared one."""
+    def attach_pool():
+        threading.current_thread().db_pool = pool
+
+    return ThreadPoolExecutor(max_workers=DB_READ_WORKERS, thread_name_prefix=name, initializer=attach_pool)
+
+@st.cache_resource
+def get_read_executor(path=DB_PATH):
+    """Thread pool for prefetching page data over read-only connections."""
+    return reader_executor(ConnectionPool(path, read_only=True), "db-reader")
+
+class PageData:
+    """Datasets one rerun needs, fetched concurrently.
+
+    `loaders` maps dataset names to zero-argument read functions. The page
+    declares what it will read with want() before rendering; get() then
+    waits only for that dataset, so the rerun costs the slowest query
+    instead of the sum of all of them. Datasets nobody declared are loaded
+    on first get().
+    """
+
+    def __init__(self, loaders, executor=None):
+        self.loaders = loaders
+        self.executor = executor or get_read_executor()
+        self._futures = {}
+
+    def want(self, *names):
+        for name in names:
+            if name not in self._futures:
+                self._futures[name] = self.executor.submit(self.loaders[name])
+        return self
+
+    def get(self, name):
+        self.want(name)
+        return self._futures[name].result()
+
+# Optional per-group sharding. With LYCA_DB_SHARDING=1 the group-scoped
+# tables of each group live in their own file under data/shards/, with
+# their own pool, writer thread and write lock; everything else stays in
+# DB_PATH. Each shard owns the id range [index * SHARD_ID_SPAN, ...), so
+# ids stay unique across files and a row id alone routes to its shard.
+# Rows written before sharding was enabled stay in the main file, which
+# group reads therefore always consult as well.
+
+SHARDING_ENABLED = os.environ.get("LYCA_DB_SHARDING", "0") == "1"
+SHARD_DIR = os.path.join("data", "shards")
+SHARDED_TABLES = ("requests", "request_comments", "group_messages")
+# Per-file bookkeeping the sharded tables' triggers write to
+SHARDED_AUX_TABLES = ("requests_fts", "row_versions", "request_tombstones", "counters", "message_reactions",
+                      "message_mentions")
+SHARD_ID_SPAN = 10 ** 9
+
+class Shard:
+    __slots__ = ("group_name", "index", "pool", "writer")
+
+    def __init__(self, group_name, index, pool, writer):
+        self.group_name = group_name
+        self.index = index
+        self.pool = pool
+        self.writer = writer
+
+def shard_path(group_name, index):
+    slug = re.sub(r"[^a-z0-9]+", "-", group_name.lower()).strip("-") or "group"
+    return os.path.join(SHARD_DIR, f"{index:03d}-{slug}.db")
+
+def sync_shard_schema(main_conn, shard_conn):
+    """Mirror the sharded tables (columns, indexes, triggers, bookkeeping) from the main file."""
+    tables = SHARDED_TABLES + SHARDED_AUX_TABLES
+    placeholders = ", ".join("?" * len(tables))
+    objects = main_conn.execute(f"""
+        SELECT type, name, tbl_name, sql FROM sqlite_master
+        WHERE tbl_name IN ({placeholders}) AND sql IS NOT NULL
+        ORDER BY type != 'table', name
+    """, tables).fetchall()
+    for kind, name, table, sql in objects:
+        if kind == "table":
+            if table_columns(shard_conn, table):
+                existing = table_columns(shard_conn, table)
+                for _, column, col_type, not_null, default, _ in main_conn.execute(f"PRAGMA table_info({table})"):
+                    if column not in existing:
+                        definition = col_type + (" NOT NULL" if not_null else "") + \
+                            (f" DEFAULT {default}" if default is not None else "")
+                        shard_conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            else:
+                shard_conn.execute(re.sub(r"^CREATE TABLE (IF NOT EXISTS )?", "CREATE TABLE IF NOT EXISTS ", sql))
+                # Shard created before these existed: fill them from its rows
+                if table == "requests_fts":
+                    rebuild_request_search(shard_conn)
+                elif table == "counters":
+                    rebuild_counters(shard_conn)
+                elif table == "message_reactions":
+                    copy_json_reactions(shard_conn)
+                elif table == "message_mentions":
+                    copy_mentions(shard_conn)
+        elif kind == "trigger":
+            # Triggers are redefined by later migrations: replace stale ones
+            current = shard_conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+                                         (name,)).fetchone()
+            if current is None or current[0] != sql:
+                shard_conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+                shard_conn.execute(sql)
+        else:
+            shard_conn.execute(re.sub(r"^CREATE (UNIQUE )?INDEX (IF NOT EXISTS )?",
+                                      r"CREATE \1INDEX IF NOT EXISTS ", sql))
+
+class ShardRouter:
+    """Maps group names and row ids to shards, opening shard files on demand."""
+
+    def __init__(self, main_pool):
+        self.main_pool = main_pool
+        self._lock = threading.Lock()
+        self._by_group = {}
+        self._by_index = {}
+        self._loaded = False
+
+    def _load(self):
+        for group_name, index in self.main_pool.connection().execute(
+                "SELECT group_name, shard_index FROM shards"):
+            self._open(group_name, index)
+        self._loaded = True
+
+    def _open(self, group_name, index, create=False):
+        pool = ConnectionPool(shard_path(group_name, index))
+        with pool.transaction("schema") as conn:
+            sync_shard_schema(self.main_pool.connection(), conn)
+            if create:
+                conn.executemany("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)",
+                                 [(table, index * SHARD_ID_SPAN) for table in SHARDED_TABLES])
+        writer = WriteQueue(pool)
+        writer.start()
+        atexit.register(writer.stop)
+        shard = Shard(group_name, index, pool, writer)
+        self._by_group[group_name] = self._by_index[index] = shard
+        return shard
+
+    def _find(self, group_name):
+        if not self._loaded:
+            self._load()
+        if group_name in self._by_group:
+            return self._by_group[group_name]
+        # Another process may have registered it since we loaded
+        row = self.main_pool.connection().execute("SELECT shard_index FROM shards WHERE group_name = ?",
+                                                  (group_name,)).fetchone()
+        return self._open(group_name, row[0]) if row else None
+
+    def find(self, group_name):
+        """The group's existing shard, or None; never creates one (for reads)."""
+        shard = self._by_group.get(group_name)
+        if shard is not None:
+            return shard
+        with self._lock:
+            return self._find(group_name)
+
+    def shard(self, group_name):
+        """The group's shard, created (file, schema, id range) on first use."""
+        shard = self._by_group.get(group_name)
+        if shard is not None:
+            return shard
+        with self._lock:
+            shard = self._find(group_name)
+            if shard is not None:
+                return shard
+            with self.main_pool.transaction("shards") as conn:
+                index = conn.execute("SELECT COALESCE(MAX(shard_index), 0) + 1 FROM shards").fetchone()[0]
+                conn.execute("INSERT INTO shards (group_name, shard_index, created_at) VALUES (?, ?, ?)",
+                             (group_name, index, get_casablanca_time()))
+            return self._open(group_name, index, create=True)
+
+    def shard_for_id(self, row_id):
+        """Shard owning a row id, or None for rows in the main file."""
+        index = int(row_id) // SHARD_ID_SPAN
+        if index == 0:
+            return None
+        if index not in self._by_index:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+        return self._by_index.get(index)
+
+    def shards(self):
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            return sorted(self._by_index.values(), key=attrgetter("index"))
+
+@st.cache_resource
+def get_shard_router():
+    return ShardRouter(get_connection_pool())
+
+# Bound once per script run, like system_settings.
+shard_router = get_shard_router() if SHARDING_ENABLED else None
+
+def group_writer(group_name):
+    """Write queue for new group-scoped rows of `group_name`."""
+    if shard_router is None or not group_name:
+        return get_write_queue()
+    return shard_router.shard(group_name).writer
+
+def row_pool(row_id):
+    """Pool holding the group-scoped row with this id."""
+    shard = shard_router.shard_for_id(row_id) if shard_router is not None else None
+    return shard.pool if shard is not None else current_pool()
+
+def group_read_pools(group_name):
+    """Pools to read one group's rows from: its shard (if it has one) plus the main file."""
+    shard = shard_router.find(group_name) if shard_router is not None and group_name else None
+    if shard is None:
+        return [current_pool()]
+    return [shard.pool, current_pool()]
+
+def all_pools():
+    """Main pool plus every shard, for admin views that span groups."""
+    if shard_router is None:
+        return [current_pool()]
+    return [current_pool()] + [shard.pool for shard in shard_router.shards()]
+
+def fetch_merged(record_cls, sql, params=(), pools=None, limit=None, lazy=False, key=attrgetter("timestamp")):
+    """Run one query (ordered newest first by `key`) on several pools and merge the rows."""
+    pools = pools or all_pools()
+    if len(pools) == 1:
+        return fetch_records(record_cls, sql, params, lazy=lazy, pool=pools[0])
+    rows = heapq.merge(*(fetch_records(record_cls, sql, params, lazy=True, pool=pool) for pool in pools),
+                       key=key, reverse=True)
+    if limit is not None:
+        rows = islice(rows, limit)
+    return rows if lazy else list(rows)
+
+# Typed rows. Each record class lists its columns in __slots__ (so instances
+# carry no per-row __dict__) and gets a generated positional __init__, which
+# lets the row factory build a record with a single call.
+
+class Record:
+    __slots__ = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        fields = cls.__slots__
+        namespace = {}
+        exec(
+            f"def __init__(self, {', '.join(fields)}):\n"
+            + "".join(f"    self.{name} = {name}\n" for name in fields),
+            namespace
+        )
+        cls.__init__ = namespace["__init__"]
+        cls.columns = ", ".join(fields)
+
+    @classmethod
+    def row_factory(cls, cursor, row):
+        return cls(*row)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({values})"
+
+class Request(Record):
+    __slots__ = ("id", "agent_name", "request_type", "identifier", "comment",
+                 "timestamp", "completed", "group_name", "ts_epoch", "assignee", "claimed_at")
+
+    @property
+    def cursor(self):
+        """Keyset position of this row in the newest-first board order."""
+        return (self.ts_epoch, self.id)
+
+    @property
+    def active_assignee(self):
+        """Who holds this open request, if their claim lease is still running."""
+        if self.completed or not self.assignee:
+            return None
+        if self.claimed_at < datetime.now(pytz.UTC).timestamp() - CLAIM_LEASE_SECONDS:
+            return None
+        return self.assignee
+
+class RequestMatch(Record):
+    """A search hit: the request plus its FTS rank and highlighted snippet."""
+    __slots__ = Request.__slots__ + ("rank", "snippet")
+    cursor = Request.cursor
+
+class Comment(Record):
+    __slots__ = ("id", "request_id", "user", "comment", "timestamp")
+
+class Mistake(Record):
+    __slots__ = ("id", "team_leader", "agent_name", "ticket_id", "error_description", "timestamp", "ts_epoch")
+
+    cursor = Request.cursor
+
+class Message(Record):
+    __slots__ = ("id", "sender", "message", "timestamp", "mentions", "group_name")
+
+    @property
+    def mention_list(self):
+        return self.mentions.split(',') if self.mentions else []
+
+class VipMessage(Record):
+    __slots__ = ("id", "sender", "message", "timestamp", "mentions")
+
+class User(Record):
+    __slots__ = ("id", "username", "role", "group_name", "break_templates")
+
+    @property
+    def template_list(self):
+        return [t.strip() for t in (self.break_templates or '').split(',') if t.strip()]
+
+class HoldImage(Record):
+    __slots__ = ("id", "uploader", "image_data", "timestamp")
+
+class LateLogin(Record):
+    __slots__ = ("id", "agent_name", "presence_time", "login_time", "reason", "timestamp")
+
+class QualityIssue(Record):
+    __slots__ = ("id", "agent_name", "issue_type", "timing", "mobile_number", "product", "timestamp")
+
+class MidshiftIssue(Record):
+    __slots__ = ("id", "agent_name", "issue_type", "start_time", "end_time", "timestamp")
+
+def fetch_records(record_cls, sql, params=(), lazy=False, pool=None):
+    """Run a query whose select list is record_cls.columns.
+
+    Returns a list, or with lazy=True an iterator that builds records as
+    the rows are stepped. `pool` picks a shard; default is this thread's pool.
+    """
+    cursor = (pool.connection() if pool is not None else get_db_connection()).cursor()
+    cursor.row_factory = record_cls.row_factory
+    cursor.execute(sql, params)
+    return cursor if lazy else cursor.fetchall()
 
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
 def authenticate(username, password):
     conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        hashed_password = hash_password(password)
-        cursor.execute("SELECT role FROM users WHERE LOWER(username) = LOWER(?) AND password = ?", 
-                      (username, hashed_password))
-        result = cursor.fetchone()
-        return result[0] if result else None
-    finally:
-        conn.close()
+    cursor = conn.cursor()
+    hashed_password = hash_password(password)
+    cursor.execute("SELECT role FROM users WHERE LOWER(username) = LOWER(?) AND password = ?", 
+                  (username, hashed_password))
+    result = cursor.fetchone()
+    return result[0] if result else None
+
+# Schema migrations: each one runs exactly once per database, in version
+# order, inside the transaction that records it in schema_version. Append new
+# entries to MIGRATIONS; never edit one that has shipped.
+
+def table_columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+def add_column_if_missing(conn, table, column, definition):
+    if column not in table_columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def execute_statements(conn, script):
+    """Run a multi-statement script one statement at a time.
+
+    Unlike executescript(), which commits first, this keeps the
+    statements inside the caller's open transaction.
+    """
+    statement = ""
+    for part in script.split(";"):
+        statement += part + ";"
+        if sqlite3.complete_statement(statement):
+            if statement.strip(" \t\r\n;"):
+                conn.execute(statement)
+            statement = ""
+
+def migrate_base_schema(conn):
+    """Version 1: the tables and default accounts formerly created by init_db()."""
+    cursor = conn.cursor()
+    
+    # Create tables if they don't exist
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE,
+            password TEXT,
+            role TEXT CHECK(role IN ('agent', 'admin', 'qa')),
+            group_name TEXT
+        )
+    """)
+    # Databases created before groups existed
+    add_column_if_missing(conn, "users", "group_name", "TEXT")
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS vip_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender TEXT,
+            message TEXT,
+            timestamp TEXT,
+            mentions TEXT
+        )
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            agent_name TEXT,
+            request_type TEXT,
+            identifier TEXT,
+            comment TEXT,
+            timestamp TEXT,
+            completed INTEGER DEFAULT 0,
+            group_name TEXT
+        )
+    """)
+    add_column_if_missing(conn, "requests", "group_name", "TEXT")
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS mistakes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            team_leader TEXT,
+            agent_name TEXT,
+            ticket_id TEXT,
+            error_description TEXT,
+            timestamp TEXT
+        )
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS group_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender TEXT,
+            message TEXT,
+            timestamp TEXT,
+            mentions TEXT,
+            group_name TEXT,
+            reactions TEXT DEFAULT '{}'
+        )
+    """)
+    add_column_if_missing(conn, "group_messages", "group_name", "TEXT")
+    add_column_if_missing(conn, "group_messages", "reactions", "TEXT DEFAULT '{}'")
+    # HOLD TABLE: Add hold_tables table if not exists
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS hold_tables (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uploader TEXT,
+            table_data TEXT,
+            timestamp TEXT
+        )
+    """)
 
-def init_db():
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        
-        # Create tables if they don't exist
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE,
-                password TEXT,
-                role TEXT CHECK(role IN ('agent', 'admin', 'qa')),
-                group_name TEXT
-            )
-        """)
-        # MIGRATION: Add group_name if not exists
-        try:
-            cursor.execute("ALTER TABLE users ADD COLUMN group_name TEXT")
-        except Exception:
-            pass
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS vip_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sender TEXT,
-                message TEXT,
-                timestamp TEXT,
-                mentions TEXT
-            )
-        """)
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS requests (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                agent_name TEXT,
-                request_type TEXT,
-                identifier TEXT,
-                comment TEXT,
-                timestamp TEXT,
-                completed INTEGER DEFAULT 0,
-                group_name TEXT
-            )
-        """)
-        # MIGRATION: Add group_name if not exists
-        try:
-            cursor.execute("ALTER TABLE requests ADD COLUMN group_name TEXT")
-        except Exception:
-            pass
-        
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS system_settings (
+            id INTEGER PRIMARY KEY,
+            killswitch_enabled INTEGER DEFAULT 0,
+            chat_killswitch_enabled INTEGER DEFAULT 0
+        )
+    """)
+    # Ensure there is always a row with id=1
+    cursor.execute("INSERT OR IGNORE INTO system_settings (id, killswitch_enabled, chat_killswitch_enabled) VALUES (1, 0, 0)")
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS request_comments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            request_id INTEGER,
+            user TEXT,
+            comment TEXT,
+            timestamp TEXT,
+            FOREIGN KEY(request_id) REFERENCES requests(id)
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS hold_images (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uploader TEXT,
+            image_data BLOB,
+            timestamp TEXT
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS late_logins (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            agent_name TEXT,
+            presence_time TEXT,
+            login_time TEXT,
+            reason TEXT,
+            timestamp TEXT
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS quality_issues (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            agent_name TEXT,
+            issue_type TEXT,
+            timing TEXT,
+            mobile_number TEXT,
+            product TEXT,
+            timestamp TEXT
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS midshift_issues (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            agent_name TEXT,
+            issue_type TEXT,
+            start_time TEXT,
+            end_time TEXT,
+            timestamp TEXT
+        )
+    """)
+    
+    # Create default admin account
+    cursor.execute("""
+        INSERT OR IGNORE INTO users (username, password, role) 
+        VALUES (?, ?, ?)
+    """, ("taha kirri", hash_password("Cursed@99"), "admin"))
+    
+    # Create other admin accounts
+    admin_accounts = [
+        ("taha kirri", "Cursed@99"),
+        ("admin", "p@ssWord995"),
+    ]
+    
+    for username, password in admin_accounts:
         cursor.execute("""
-            CREATE TABLE IF NOT EXISTS mistakes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                team_leader TEXT,
-                agent_name TEXT,
-                ticket_id TEXT,
-                error_description TEXT,
-                timestamp TEXT
-            )
-        """)
-        
+            INSERT OR IGNORE INTO users (username, password, role) 
+            VALUES (?, ?, ?)
+        """, (username, hash_password(password), "admin"))
+    
+    # Create agent accounts
+    agents = [
+        ("agent", "Agent@3356"),
+    ]
+    
+    for agent_name, workspace_id in agents:
         cursor.execute("""
-            CREATE TABLE IF NOT EXISTS group_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sender TEXT,
-                message TEXT,
-                timestamp TEXT,
-                mentions TEXT,
-                group_name TEXT,
-                reactions TEXT DEFAULT '{}'
+            INSERT OR IGNORE INTO users (username, password, role) 
+            VALUES (?, ?, ?)
+        """, (agent_name, hash_password(workspace_id), "agent"))
+
+def migrate_break_templates(conn):
+    """Version 2: per-agent break template assignments."""
+    add_column_if_missing(conn, "users", "break_templates", "TEXT")
+
+def migrate_secondary_indexes(conn):
+    """Version 3: indexes for the filters and sort orders the pages use."""
+    execute_statements(conn, """
+        CREATE INDEX IF NOT EXISTS idx_requests_timestamp ON requests(timestamp);
+        CREATE INDEX IF NOT EXISTS idx_requests_group_timestamp ON requests(group_name, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_request_comments_request ON request_comments(request_id, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_group_messages_group_timestamp ON group_messages(group_name, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_users_username_lower ON users(LOWER(username));
+        CREATE INDEX IF NOT EXISTS idx_users_group ON users(group_name);
+        CREATE INDEX IF NOT EXISTS idx_mistakes_timestamp ON mistakes(timestamp);
+        CREATE INDEX IF NOT EXISTS idx_late_logins_timestamp ON late_logins(timestamp);
+        CREATE INDEX IF NOT EXISTS idx_quality_issues_timestamp ON quality_issues(timestamp);
+        CREATE INDEX IF NOT EXISTS idx_midshift_issues_timestamp ON midshift_issues(timestamp);
+        CREATE INDEX IF NOT EXISTS idx_hold_images_timestamp ON hold_images(timestamp);
+        CREATE INDEX IF NOT EXISTS idx_vip_messages_timestamp ON vip_messages(timestamp);
+    """)
+
+def migrate_settings_version(conn):
+    """Version 4: change counter other processes use to notice setting toggles."""
+    add_column_if_missing(conn, "system_settings", "version", "INTEGER NOT NULL DEFAULT 0")
+
+# Tables whose rows carry a display `timestamp` string and, from schema
+# version 5, the matching UTC epoch in `ts_epoch` used for ranges and sorts.
+EPOCH_TABLES = (
+    "requests", "request_comments", "mistakes", "group_messages", "vip_messages",
+    "hold_images", "late_logins", "quality_issues", "midshift_issues",
+)
+
+EPOCH_BACKFILL_BATCH = 2000
+
+def migrate_epoch_columns(conn):
+    """Version 5: indexed integer UTC epoch next to every timestamp string.
+
+    Existing rows are filled in afterwards by backfill_epoch_columns() in
+    short batches, so the upgrade itself does not hold the write lock
+    for a full-table rewrite; init_db() finishes that backfill before any
+    page reads the new column.
+    """
+    for table in EPOCH_TABLES:
+        add_column_if_missing(conn, table, "ts_epoch", "INTEGER")
+        conn.execute(f"DROP INDEX IF EXISTS idx_{table}_timestamp")
+        if table != "request_comments":
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_ts_epoch ON {table}(ts_epoch)")
+    execute_statements(conn, """
+        DROP INDEX IF EXISTS idx_requests_group_timestamp;
+        DROP INDEX IF EXISTS idx_group_messages_group_timestamp;
+        DROP INDEX IF EXISTS idx_request_comments_request;
+        CREATE INDEX IF NOT EXISTS idx_requests_group_ts_epoch ON requests(group_name, ts_epoch);
+        CREATE INDEX IF NOT EXISTS idx_group_messages_group_ts_epoch ON group_messages(group_name, ts_epoch);
+        CREATE INDEX IF NOT EXISTS idx_request_comments_request ON request_comments(request_id, ts_epoch);
+        CREATE INDEX IF NOT EXISTS idx_request_comments_ts_epoch ON request_comments(ts_epoch);
+    """)
+
+def migrate_shard_registry(conn):
+    """Version 6: registry of per-group shard files (used with LYCA_DB_SHARDING=1)."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS shards (
+            group_name TEXT PRIMARY KEY,
+            shard_index INTEGER UNIQUE NOT NULL,
+            created_at TEXT
+        )
+    """)
+
+def migrate_request_board_indexes(conn):
+    """Version 7: indexes for the paginated board's group/status filters."""
+    execute_statements(conn, """
+        CREATE INDEX IF NOT EXISTS idx_requests_group_status_ts_epoch ON requests(group_name, completed, ts_epoch);
+        CREATE INDEX IF NOT EXISTS idx_requests_status_ts_epoch ON requests(completed, ts_epoch);
+    """)
+
+def rebuild_request_search(conn):
+    """Refill requests_fts from requests and their comment threads."""
+    conn.execute("DELETE FROM requests_fts")
+    conn.execute("""
+        INSERT INTO requests_fts (rowid, agent_name, request_type, identifier, comment, thread)
+        SELECT r.id, r.agent_name, r.request_type, r.identifier, r.comment,
+               COALESCE((SELECT group_concat(c.comment, ' ') FROM request_comments c
+                         WHERE c.request_id = r.id), '')
+        FROM requests r
+    """)
+
+def migrate_request_search(conn):
+    """Version 8: FTS5 index over requests and their comment threads.
+
+    One row per request (rowid = requests.id); `thread` holds the text of
+    its request_comments. Triggers keep it in step with both tables.
+    """
+    execute_statements(conn, """
+        CREATE VIRTUAL TABLE IF NOT EXISTS requests_fts USING fts5(
+            agent_name, request_type, identifier, comment, thread,
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        );
+        CREATE TRIGGER IF NOT EXISTS requests_fts_insert AFTER INSERT ON requests BEGIN
+            INSERT INTO requests_fts (rowid, agent_name, request_type, identifier, comment, thread)
+            VALUES (new.id, new.agent_name, new.request_type, new.identifier, new.comment, '');
+        END;
+        CREATE TRIGGER IF NOT EXISTS requests_fts_update
+        AFTER UPDATE OF agent_name, request_type, identifier, comment ON requests BEGIN
+            UPDATE requests_fts SET agent_name = new.agent_name, request_type = new.request_type,
+                                    identifier = new.identifier, comment = new.comment
+            WHERE rowid = new.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS requests_fts_delete AFTER DELETE ON requests BEGIN
+            DELETE FROM requests_fts WHERE rowid = old.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS request_comments_fts_insert AFTER INSERT ON request_comments BEGIN
+            UPDATE requests_fts SET thread = thread || ' ' || COALESCE(new.comment, '')
+            WHERE rowid = new.request_id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS request_comments_fts_delete AFTER DELETE ON request_comments BEGIN
+            UPDATE requests_fts SET thread = COALESCE((SELECT group_concat(comment, ' ') FROM request_comments
+                                                       WHERE request_id = old.request_id), '')
+            WHERE rowid = old.request_id;
+        END;
+    """)
+    rebuild_request_search(conn)
+
+def migrate_request_versions(conn):
+    """Version 9: row versions on requests for the board's delta feed.
+
+    row_versions holds one counter per file; every insert, edit, status
+    change or new comment stamps the request with the next value, and
+    deletions leave a tombstone. Tombstones below `floor` were pruned.
+    """
+    add_column_if_missing(conn, "requests", "row_version", "INTEGER NOT NULL DEFAULT 0")
+    execute_statements(conn, """
+        CREATE TABLE IF NOT EXISTS row_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            floor INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS request_tombstones (
+            id INTEGER PRIMARY KEY,
+            row_version INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_requests_row_version ON requests(row_version);
+        CREATE INDEX IF NOT EXISTS idx_request_tombstones_row_version ON request_tombstones(row_version);
+        CREATE TRIGGER IF NOT EXISTS requests_version_insert AFTER INSERT ON requests BEGIN
+            INSERT INTO row_versions (name, version) VALUES ('requests', 1)
+            ON CONFLICT (name) DO UPDATE SET version = version + 1;
+            UPDATE requests SET row_version = (SELECT version FROM row_versions WHERE name = 'requests')
+            WHERE id = new.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS requests_version_update
+        AFTER UPDATE OF agent_name, request_type, identifier, comment, completed, group_name ON requests BEGIN
+            INSERT INTO row_versions (name, version) VALUES ('requests', 1)
+            ON CONFLICT (name) DO UPDATE SET version = version + 1;
+            UPDATE requests SET row_version = (SELECT version FROM row_versions WHERE name = 'requests')
+            WHERE id = new.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS request_comments_version_insert AFTER INSERT ON request_comments BEGIN
+            INSERT INTO row_versions (name, version) VALUES ('requests', 1)
+            ON CONFLICT (name) DO UPDATE SET version = version + 1;
+            UPDATE requests SET row_version = (SELECT version FROM row_versions WHERE name = 'requests')
+            WHERE id = new.request_id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS requests_version_delete AFTER DELETE ON requests BEGIN
+            INSERT INTO row_versions (name, version) VALUES ('requests', 1)
+            ON CONFLICT (name) DO UPDATE SET version = version + 1;
+            INSERT OR REPLACE INTO request_tombstones (id, row_version)
+            VALUES (old.id, (SELECT version FROM row_versions WHERE name = 'requests'));
+        END;
+    """)
+
+# Counter name -> (table, grouping expression, condition) it counts. Names
+# are "<counter>:<group>" ("mistakes:" has no group) so one group's value
+# is a primary-key lookup and all groups are a short range scan.
+COUNTERS = {
+    "requests": ("requests", "COALESCE(group_name, '')", "1"),
+    "pending_requests": ("requests", "COALESCE(group_name, '')", "completed = 0"),
+    "mistakes": ("mistakes", "''", "1"),
+    "messages": ("group_messages", "COALESCE(group_name, '')", "1"),
+}
+
+def rebuild_counters(conn):
+    """Recount every counter from the tables present in this file."""
+    conn.execute("DELETE FROM counters")
+    for name, (table, group, condition) in COUNTERS.items():
+        if table_columns(conn, table):
+            conn.execute(f"""
+                INSERT INTO counters (name, value)
+                SELECT '{name}:' || {group}, COUNT(*) FROM {table} WHERE {condition} GROUP BY 1
+            """)
+
+def migrate_counters(conn):
+    """Version 10: trigger-maintained counters for the sidebar badges."""
+    bump = """INSERT INTO counters (name, value) VALUES ({name}, {delta})
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;"""
+    requests_name = "'requests:' || COALESCE({row}.group_name, '')"
+    pending_name = "'pending_requests:' || COALESCE({row}.group_name, '')"
+    messages_name = "'messages:' || COALESCE({row}.group_name, '')"
+    execute_statements(conn, f"""
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TRIGGER IF NOT EXISTS requests_count_insert AFTER INSERT ON requests BEGIN
+            {bump.format(name=requests_name.format(row="new"), delta=1)}
+            {bump.format(name=pending_name.format(row="new"), delta="new.completed = 0")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS requests_count_delete AFTER DELETE ON requests BEGIN
+            {bump.format(name=requests_name.format(row="old"), delta=-1)}
+            {bump.format(name=pending_name.format(row="old"), delta="-(old.completed = 0)")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS requests_count_update AFTER UPDATE OF completed, group_name ON requests
+        WHEN old.completed IS NOT new.completed OR old.group_name IS NOT new.group_name BEGIN
+            {bump.format(name=requests_name.format(row="old"), delta=-1)}
+            {bump.format(name=requests_name.format(row="new"), delta=1)}
+            {bump.format(name=pending_name.format(row="old"), delta="-(old.completed = 0)")}
+            {bump.format(name=pending_name.format(row="new"), delta="new.completed = 0")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS mistakes_count_insert AFTER INSERT ON mistakes BEGIN
+            {bump.format(name="'mistakes:'", delta=1)}
+        END;
+        CREATE TRIGGER IF NOT EXISTS mistakes_count_delete AFTER DELETE ON mistakes BEGIN
+            {bump.format(name="'mistakes:'", delta=-1)}
+        END;
+        CREATE TRIGGER IF NOT EXISTS group_messages_count_insert AFTER INSERT ON group_messages BEGIN
+            {bump.format(name=messages_name.format(row="new"), delta=1)}
+        END;
+        CREATE TRIGGER IF NOT EXISTS group_messages_count_delete AFTER DELETE ON group_messages BEGIN
+            {bump.format(name=messages_name.format(row="old"), delta=-1)}
+        END;
+    """)
+    rebuild_counters(conn)
+
+def migrate_request_claims(conn):
+    """Version 11: assignee/claimed_at for the claim-next work queue.
+
+    claimed_at is a UTC epoch, 0 when unclaimed, so "unclaimed or lease
+    expired" is the single test claimed_at < cutoff, checked while walking
+    the open requests oldest first on the (group_name, completed, ts_epoch)
+    index. Claims bump the row version so every board sees them.
+    """
+    add_column_if_missing(conn, "requests", "assignee", "TEXT")
+    add_column_if_missing(conn, "requests", "claimed_at", "INTEGER NOT NULL DEFAULT 0")
+    execute_statements(conn, """
+        CREATE INDEX IF NOT EXISTS idx_requests_assignee ON requests(assignee) WHERE completed = 0;
+        DROP TRIGGER IF EXISTS requests_version_update;
+        CREATE TRIGGER requests_version_update
+        AFTER UPDATE OF agent_name, request_type, identifier, comment, completed, group_name,
+                        assignee, claimed_at ON requests BEGIN
+            INSERT INTO row_versions (name, version) VALUES ('requests', 1)
+            ON CONFLICT (name) DO UPDATE SET version = version + 1;
+            UPDATE requests SET row_version = (SELECT version FROM row_versions WHERE name = 'requests')
+            WHERE id = new.id;
+        END;
+    """)
+
+def migrate_mistake_indexes(conn):
+    """Version 12: indexes for the Mistakes Log's agent/team leader filters and summaries."""
+    execute_statements(conn, """
+        CREATE INDEX IF NOT EXISTS idx_mistakes_agent_ts_epoch ON mistakes(agent_name, ts_epoch);
+        CREATE INDEX IF NOT EXISTS idx_mistakes_team_leader_ts_epoch ON mistakes(team_leader, ts_epoch);
+    """)
+
+def migrate_chat_cursor_index(conn):
+    """Version 13: (group_name, id) index for polling a group's chat by last-seen id."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_group_messages_group_id ON group_messages(group_name, id)")
+
+def copy_json_reactions(conn):
+    """Copy the legacy group_messages.reactions JSON ({emoji: [usernames]}) into rows."""
+    conn.execute("""
+        INSERT OR IGNORE INTO message_reactions (message_id, emoji, username)
+        SELECT m.id, r.key, u.value
+        FROM group_messages m, json_each(m.reactions) r, json_each(r.value) u
+        WHERE json_valid(m.reactions) AND json_type(m.reactions) = 'object' AND json_type(r.value) = 'array'
+    """)
+
+def migrate_message_reactions(conn):
+    """Version 14: one row per reaction instead of the reactions JSON blob.
+
+    The primary key makes a toggle a single DELETE or INSERT and keeps the
+    per-message, per-emoji counts an index-ordered GROUP BY. The old
+    column is left in place but no longer read or written.
+    """
+    execute_statements(conn, """
+        CREATE TABLE IF NOT EXISTS message_reactions (
+            message_id INTEGER NOT NULL,
+            emoji TEXT NOT NULL,
+            username TEXT NOT NULL,
+            PRIMARY KEY (message_id, emoji, username)
+        ) WITHOUT ROWID;
+        CREATE TRIGGER IF NOT EXISTS group_messages_reactions_delete AFTER DELETE ON group_messages BEGIN
+            DELETE FROM message_reactions WHERE message_id = old.id;
+        END;
+    """)
+    copy_json_reactions(conn)
+
+# Chat table -> channel name used in message_mentions
+MENTION_CHANNELS = {"group_messages": "group", "vip_messages": "vip"}
+
+def insert_mentions(conn, channel, message_id, usernames):
+    conn.executemany("INSERT OR IGNORE INTO message_mentions (username, channel, message_id) VALUES (?, ?, ?)",
+                     [(username, channel, message_id) for username in set(usernames) if username])
+
+def copy_mentions(conn):
+    """Index the comma-joined mentions of existing messages in the chat tables present."""
+    for table, channel in MENTION_CHANNELS.items():
+        if table_columns(conn, table):
+            for message_id, mentions in conn.execute(
+                    f"SELECT id, mentions FROM {table} WHERE mentions IS NOT NULL AND mentions != ''").fetchall():
+                insert_mentions(conn, channel, message_id, mentions.split(","))
+
+def migrate_message_mentions(conn):
+    """Version 15: message_mentions, one row per @mention, keyed by username first.
+
+    Deleting a message removes its rows by probing the key with the
+    usernames from the message's own comma-joined mentions column.
+    """
+    execute_statements(conn, """
+        CREATE TABLE IF NOT EXISTS message_mentions (
+            username TEXT NOT NULL,
+            channel TEXT NOT NULL,
+            message_id INTEGER NOT NULL,
+            PRIMARY KEY (username, channel, message_id)
+        ) WITHOUT ROWID;
+        CREATE TRIGGER IF NOT EXISTS group_messages_mentions_delete AFTER DELETE ON group_messages BEGIN
+            DELETE FROM message_mentions WHERE channel = 'group' AND message_id = old.id
+                AND username IN (SELECT value FROM json_each('["' || replace(old.mentions, ',', '","') || '"]'));
+        END;
+        CREATE TRIGGER IF NOT EXISTS vip_messages_mentions_delete AFTER DELETE ON vip_messages BEGIN
+            DELETE FROM message_mentions WHERE channel = 'vip' AND message_id = old.id
+                AND username IN (SELECT value FROM json_each('["' || replace(old.mentions, ',', '","') || '"]'));
+        END;
+    """)
+    copy_mentions(conn)
+
+def migrate_mention_delete_index(conn):
+    """Version 16: delete a message's mentions through a (channel, message_id) index.
+
+    The version 15 triggers rebuilt the usernames as JSON from the
+    comma-joined mentions column, which missed rows whenever that column
+    disagreed with message_mentions.
+    """
+    execute_statements(conn, """
+        CREATE INDEX IF NOT EXISTS idx_message_mentions_message ON message_mentions(channel, message_id);
+        DROP TRIGGER IF EXISTS group_messages_mentions_delete;
+        CREATE TRIGGER group_messages_mentions_delete AFTER DELETE ON group_messages BEGIN
+            DELETE FROM message_mentions WHERE channel = 'group' AND message_id = old.id;
+        END;
+        DROP TRIGGER IF EXISTS vip_messages_mentions_delete;
+        CREATE TRIGGER vip_messages_mentions_delete AFTER DELETE ON vip_messages BEGIN
+            DELETE FROM message_mentions WHERE channel = 'vip' AND message_id = old.id;
+        END;
+    """)
+
+MIGRATIONS = [
+    (1, "Base tables, legacy columns and default accounts", migrate_base_schema),
+    (2, "users.break_templates", migrate_break_templates),
+    (3, "Secondary indexes for hot queries", migrate_secondary_indexes),
+    (4, "system_settings.version", migrate_settings_version),
+    (5, "Integer epoch timestamp columns", migrate_epoch_columns),
+    (6, "Shard registry", migrate_shard_registry),
+    (7, "Request board filter indexes", migrate_request_board_indexes),
+    (8, "Full-text search over requests", migrate_request_search),
+    (9, "Request row versions for delta refresh", migrate_request_versions),
+    (10, "Trigger-maintained badge counters", migrate_counters),
+    (11, "Request claims for the work queue", migrate_request_claims),
+    (12, "Mistake filter indexes", migrate_mistake_indexes),
+    (13, "Chat cursor index", migrate_chat_cursor_index),
+    (14, "Message reactions table", migrate_message_reactions),
+    (15, "Message mentions index", migrate_message_mentions),
+    (16, "Message mentions delete index", migrate_mention_delete_index),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn):
+    try:
+        return conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] or 0
+    except sqlite3.OperationalError:
+        return 0  # schema_version does not exist yet
+
+def run_migrations():
+    """Apply every pending migration; returns the versions applied."""
+    applied = []
+    with db_transaction("schema") as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TEXT
             )
         """)
-        # MIGRATION: Add group_name if not exists
-        try:
-            cursor.execute("ALTER TABLE group_messages ADD COLUMN group_name TEXT")
-        except Exception:
-            pass
-        # MIGRATION: Add reactions column if not exists
-        try:
-            cursor.execute("ALTER TABLE group_messages ADD COLUMN reactions TEXT DEFAULT '{}' ")
-        except Exception:
-            pass
-        # HOLD TABLE: Add hold_tables table if not exists
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS hold_tables (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                uploader TEXT,
-                table_data TEXT,
-                timestamp TEXT
+        # Re-read under the write lock: another process may have migrated
+        current = get_schema_version(conn)
+        for version, description, migrate in MIGRATIONS:
+            if version <= current:
+                continue
+            migrate(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, get_casablanca_time())
             )
-        """)
+            applied.append(version)
+    return applied
 
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS system_settings (
-                id INTEGER PRIMARY KEY,
-                killswitch_enabled INTEGER DEFAULT 0,
-                chat_killswitch_enabled INTEGER DEFAULT 0
-            )
-        """)
-        # Ensure there is always a row with id=1
-        cursor.execute("INSERT OR IGNORE INTO system_settings (id, killswitch_enabled, chat_killswitch_enabled) VALUES (1, 0, 0)")
+def init_db():
+    """Bring the schema up to date; once current this is a single version read."""
+    if get_schema_version(get_db_connection()) < SCHEMA_VERSION:
+        run_migrations()
+    finish_epoch_backfill()
 
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS request_comments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                request_id INTEGER,
-                user TEXT,
-                comment TEXT,
-                timestamp TEXT,
-                FOREIGN KEY(request_id) REFERENCES requests(id)
-            )
-        """)
+def backfill_epoch_columns(batch_size=EPOCH_BACKFILL_BATCH):
+    """Fill ts_epoch for rows written before schema version 5; returns {table: rows}.
 
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS hold_images (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                uploader TEXT,
-                image_data BLOB,
-                timestamp TEXT
-            )
-        """)
+    Each batch is its own short transaction so live writers interleave.
+    Unparseable timestamps get 0 so they are not picked up again.
+    """
+    conn = get_db_connection()
+    filled = {}
+    for table in EPOCH_TABLES:
+        while True:
+            rows = conn.execute(f"SELECT id, timestamp FROM {table} WHERE ts_epoch IS NULL LIMIT ?",
+                                (batch_size,)).fetchall()
+            if not rows:
+                break
+            updates = []
+            for row_id, timestamp in rows:
+                try:
+                    updates.append((casablanca_to_epoch(timestamp), row_id))
+                except (TypeError, ValueError):
+                    updates.append((0, row_id))
+            with db_transaction(table) as tx:
+                tx.executemany(f"UPDATE {table} SET ts_epoch = ? WHERE id = ? AND ts_epoch IS NULL", updates)
+            filled[table] = filled.get(table, 0) + len(updates)
+    return filled
+
+@st.cache_resource
+def finish_epoch_backfill():
+    """Run backfill_epoch_columns() to completion once per process.
+
+    init_db() calls this before the first page reads, so readers never see
+    a NULL ts_epoch; a second process starting mid-backfill helps finish it.
+    """
+    return backfill_epoch_columns()
+
+SETTINGS_CACHE_TTL_SECONDS = float(os.environ.get("LYCA_SETTINGS_CACHE_TTL", "2"))
+
+class SettingsCache:
+    """Process-wide cache of the system_settings row.
+
+    Lookups inside the TTL are a clock read and a dict lookup. Every toggle
+    bumps system_settings.version; when the TTL runs out only the version
+    is read, and the row is reloaded only when it moved. Toggles in this
+    process also invalidate immediately.
+    """
+
+    def __init__(self, ttl=SETTINGS_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self.values = {}
+        self.version = None
+        self.expires_at = 0.0
+        self.refreshes = 0
+        self.changes = 0
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        if monotonic() >= self.expires_at:
+            self.refresh()
+        return self.values.get(name, False)
+
+    def refresh(self):
+        with self._lock:
+            if monotonic() < self.expires_at:
+                return  # Another thread refreshed while we waited
+            conn = get_db_connection()
+            row = conn.execute("SELECT version FROM system_settings WHERE id = 1").fetchone()
+            version = row[0] if row else 0
+            if version != self.version:
+                row = conn.execute("""
+                    SELECT killswitch_enabled, chat_killswitch_enabled, version
+                    FROM system_settings WHERE id = 1
+                """).fetchone()
+                killswitch, chat_killswitch, version = row if row else (0, 0, 0)
+                self.values = {
+                    "killswitch_enabled": bool(killswitch),
+                    "chat_killswitch_enabled": bool(chat_killswitch),
+                }
+                self.version = version
+                self.changes += 1
+            self.refreshes += 1
+            self.expires_at = monotonic() + self.ttl
 
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS late_logins (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                agent_name TEXT,
-                presence_time TEXT,
-                login_time TEXT,
-                reason TEXT,
-                timestamp TEXT
-            )
-        """)
+    def invalidate(self):
+        self.expires_at = 0.0
 
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS quality_issues (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                agent_name TEXT,
-                issue_type TEXT,
-                timing TEXT,
-                mobile_number TEXT,
-                product TEXT,
-                timestamp TEXT
-            )
-        """)
+@st.cache_resource
+def get_settings_cache():
+    return SettingsCache()
 
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS midshift_issues (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                agent_name TEXT,
-                issue_type TEXT,
-                start_time TEXT,
-                end_time TEXT,
-                timestamp TEXT
-            )
-        """)
-        
-        # Create default admin account
-        cursor.execute("""
-            INSERT OR IGNORE INTO users (username, password, role) 
-            VALUES (?, ?, ?)
-        """, ("taha kirri", hash_password("Cursed@99"), "admin"))
-        
-        # Create other admin accounts
-        admin_accounts = [
-            ("taha kirri", "Cursed@99"),
-            ("admin", "p@ssWord995"),
-        ]
-        
-        for username, password in admin_accounts:
-            cursor.execute("""
-                INSERT OR IGNORE INTO users (username, password, role) 
-                VALUES (?, ?, ?)
-            """, (username, hash_password(password), "admin"))
-        
-        # Create agent accounts
-        agents = [
-            ("agent", "Agent@3356"),
-        ]
-        
-        for agent_name, workspace_id in agents:
-            cursor.execute("""
-                INSERT OR IGNORE INTO users (username, password, role) 
-                VALUES (?, ?, ?)
-            """, (agent_name, hash_password(workspace_id), "agent"))
-        
-        conn.commit()
-    finally:
-        conn.close()
+# Bound once per script run; get_settings_cache() itself costs a cache lookup.
+system_settings = get_settings_cache()
 
 def is_killswitch_enabled():
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT killswitch_enabled FROM system_settings WHERE id = 1")
-        result = cursor.fetchone()
-        return bool(result[0]) if result else False
-    finally:
-        conn.close()
+    return system_settings.get("killswitch_enabled")
 
 def is_chat_killswitch_enabled():
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT chat_killswitch_enabled FROM system_settings WHERE id = 1")
-        result = cursor.fetchone()
-        return bool(result[0]) if result else False
-    finally:
-        conn.close()
+    return system_settings.get("chat_killswitch_enabled")
 
 def toggle_killswitch(enable):
-    conn = get_db_connection()
-    try:
+    with db_transaction("system_settings") as conn:
         cursor = conn.cursor()
-        cursor.execute("UPDATE system_settings SET killswitch_enabled = ? WHERE id = 1",
+        cursor.execute("UPDATE system_settings SET killswitch_enabled = ?, version = version + 1 WHERE id = 1",
                       (1 if enable else 0,))
-        conn.commit()
-        return True
-    finally:
-        conn.close()
+    system_settings.invalidate()
+    return True
 
 def toggle_chat_killswitch(enable):
-    conn = get_db_connection()
-    try:
+    with db_transaction("system_settings") as conn:
         cursor = conn.cursor()
-        cursor.execute("UPDATE system_settings SET chat_killswitch_enabled = ? WHERE id = 1",
+        cursor.execute("UPDATE system_settings SET chat_killswitch_enabled = ?, version = version + 1 WHERE id = 1",
                       (1 if enable else 0,))
-        conn.commit()
-        return True
-    finally:
-        conn.close()
-
-def add_request(agent_name, request_type, identifier, comment, group_name=None):
+    system_settings.invalidate()
+    return True
+
+def insert_request(conn, agent_name, request_type, identifier, comment, timestamp, group_name):
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO requests (agent_name, request_type, identifier, comment, timestamp, ts_epoch, group_name)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (agent_name, request_type, identifier, comment, timestamp, casablanca_to_epoch(timestamp), group_name))
+    request_id = cursor.lastrowid
+    insert_request_comment(conn, request_id, agent_name, f"Request created: {comment}", timestamp)
+    return request_id
+
+def add_request(agent_name, request_type, identifier, comment, group_name=None, wait=True):
+    """Queue a new request; returns its id (or a Future when wait=False)."""
     if is_killswitch_enabled():
         st.error("System is currently locked. Please contact the developer.")
         return False
-        
-    conn = get_db_connection()
+    return publish_event("requests", group_name, queue_write(
+        "requests", insert_request, agent_name, request_type, identifier, comment,
+        get_casablanca_time(), group_name, wait=wait, writer=group_writer(group_name)))
+
+# Bulk import. A CSV is read in chunks of IMPORT_CHUNK_SIZE rows; valid
+# rows are grouped by destination file and written as one executemany
+# batch each (requests, then their "Request created" comments), while bad
+# rows go to a reject CSV with the reason appended.
+
+IMPORT_CHUNK_SIZE = int(os.environ.get("LYCA_IMPORT_CHUNK_SIZE", "1000"))
+IMPORT_DIR = os.path.join("data", "imports")
+IMPORT_COLUMNS = ("agent_name", "request_type", "identifier", "comment", "group_name", "timestamp")
+REQUEST_TYPES = ("Email", "Phone", "Ticket")
+
+def validate_import_row(row, group_name=None):
+    """Return (values for insert_requests, None) or (None, reason) for one CSV row."""
+    values = {column: (row.get(column) or "").strip() for column in IMPORT_COLUMNS}
+    values["group_name"] = values["group_name"] or group_name or ""
+    for column in ("agent_name", "identifier", "comment", "group_name"):
+        if not values[column]:
+            return None, f"missing {column}"
+    request_type = values["request_type"].title()
+    if request_type not in REQUEST_TYPES:
+        return None, f"request_type must be one of {', '.join(REQUEST_TYPES)}"
+    timestamp = values["timestamp"] or get_casablanca_time()
     try:
-        cursor = conn.cursor()
-        timestamp = get_casablanca_time()
+        epoch = casablanca_to_epoch(timestamp)
+    except ValueError:
+        return None, "timestamp must be YYYY-MM-DD HH:MM:SS"
+    return (values["agent_name"], request_type, values["identifier"], values["comment"],
+            timestamp, epoch, values["group_name"]), None
+
+def insert_requests(conn, rows):
+    """Insert many validated requests and their creation comments; returns the count.
+
+    AUTOINCREMENT ids only grow and the writer holds the file's write lock,
+    so the new requests are exactly those above the previous largest id.
+    """
+    last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM requests").fetchone()[0]
+    conn.executemany("""
+        INSERT INTO requests (agent_name, request_type, identifier, comment, timestamp, ts_epoch, group_name)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+    conn.execute("""
+        INSERT INTO request_comments (request_id, user, comment, timestamp, ts_epoch)
+        SELECT id, agent_name, 'Request created: ' || comment, timestamp, ts_epoch
+        FROM requests WHERE id > ?
+    """, (last_id,))
+    return len(rows)
+
+def import_requests_csv(source, reject_file=None, group_name=None, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    """Stream requests from a CSV text file into the database.
+
+    Rows without a group_name column use `group_name`. Rejected rows are
+    written to `reject_file` (a text file) with an "error" column.
+    `progress(imported, rejected)` is called after every chunk. Returns
+    {"imported", "rejected", "seconds", "rows_per_second"}.
+    """
+    if is_killswitch_enabled():
+        st.error("System is currently locked. Please contact the developer.")
+        return False
+    reader = csv.DictReader(source)
+    rejects = None
+    if reject_file is not None:
+        rejects = csv.DictWriter(reject_file, fieldnames=list(reader.fieldnames or IMPORT_COLUMNS) + ["error"],
+                                 extrasaction="ignore")
+        rejects.writeheader()
+    imported = rejected = 0
+    started = monotonic()
+    while True:
+        chunk = list(islice(reader, chunk_size))
+        if not chunk:
+            break
+        by_group = {}
+        for row in chunk:
+            values, error = validate_import_row(row, group_name)
+            if error is None:
+                by_group.setdefault(values[-1], []).append(values)
+                continue
+            rejected += 1
+            if rejects is not None:
+                rejects.writerow({**row, "error": error})
+        futures = [queue_write("requests", insert_requests, rows, wait=False, writer=group_writer(group))
+                   for group, rows in by_group.items()]
+        imported += sum(future.result(timeout=WRITE_QUEUE_ACK_TIMEOUT_SECONDS) for future in futures)
+        for group in by_group:
+            publish_event("requests", group)
+        if progress is not None:
+            progress(imported, rejected)
+    seconds = monotonic() - started
+    return {"imported": imported, "rejected": rejected, "seconds": seconds,
+            "rows_per_second": imported / seconds if seconds else 0.0}
+
+REQUESTS_PAGE_SIZE = 50
+REQUEST_ORDER = "ORDER BY ts_epoch DESC, id DESC"
+request_order_key = attrgetter("ts_epoch", "id")
+
+def requests_filter(group_name=None, status=None, before=None):
+    """WHERE clause and params for the board filters.
+
+    status is None, "open" or "done"; before is the (ts_epoch, id) cursor
+    of the last row already shown, so the next page is an index seek
+    instead of an OFFSET walk.
+    """
+    clauses, params = [], []
+    if group_name is not None:
+        clauses.append("group_name = ?")
+        params.append(group_name)
+    if status is not None:
+        clauses.append("completed = ?")
+        params.append(1 if status == "done" else 0)
+    if before is not None:
+        clauses.append("(ts_epoch, id) < (?, ?)")
+        params.extend(before)
+    return " AND ".join(clauses) or "1", params
+
+def request_pools(group_name=None):
+    return group_read_pools(group_name) if group_name is not None else all_pools()
+
+def get_requests(lazy=False, group_name=None, status=None, before=None, limit=None):
+    """Requests newest first, optionally one group/status and one keyset page."""
+    where, params = requests_filter(group_name, status, before)
+    limit_clause = ""
+    if limit is not None:
+        limit_clause = " LIMIT ?"
+        params.append(limit)
+    return fetch_merged(Request, f"SELECT {Request.columns} FROM requests WHERE {where} {REQUEST_ORDER}{limit_clause}",
+                        params, pools=request_pools(group_name), limit=limit, lazy=lazy, key=request_order_key)
+
+REQUEST_SEARCH_WHERE = """
+    LOWER(agent_name) LIKE ? 
+    OR LOWER(request_type) LIKE ? 
+    OR LOWER(identifier) LIKE ? 
+    OR LOWER(comment) LIKE ?
+"""
+
+def request_match_query(query):
+    """FTS5 query where every word in the search box must prefix-match."""
+    return " ".join(f'"{term}"*' for term in re.findall(r"\w+", query.lower()))
+
+def search_requests(query, lazy=False, include_archive=False, group_name=None, status=None, limit=None):
+    """Ranked full-text search over live requests and their comment threads.
+
+    Returns RequestMatch rows, best first, with a highlighted snippet.
+    Archived matches (substring search, newest month first) follow when
+    include_archive is set.
+    """
+    match = request_match_query(query)
+    if not match:
+        return []
+    where, params = requests_filter(group_name, status)
+    params = [match] + params
+    limit_clause = ""
+    if limit is not None:
+        limit_clause = " LIMIT ?"
+        params.append(limit)
+    columns = ", ".join(f"r.{name}" for name in Request.__slots__)
+    results = fetch_merged(RequestMatch, f"""
+        SELECT {columns}, requests_fts.rank,
+               snippet(requests_fts, -1, '<mark>', '</mark>', '…', 12)
+        FROM requests_fts JOIN requests r ON r.id = requests_fts.rowid
+        WHERE requests_fts MATCH ? AND {where}
+        ORDER BY requests_fts.rank{limit_clause}
+    """, params, pools=request_pools(group_name), limit=limit, lazy=lazy and not include_archive,
+        key=lambda match: -match.rank)
+    if include_archive:
+        results += search_archived_requests(query, group_name, status)
+    return results
+
+def search_archived_requests(query, group_name=None, status=None):
+    """Substring search over the monthly archive files (they carry no FTS index)."""
+    params = (f"%{query.lower()}%",) * 4
+    completed = None if status is None else int(status == "done")
+    return [r for r in search_archives(Request, "requests", REQUEST_SEARCH_WHERE, params)
+            if (group_name is None or r.group_name == group_name)
+            and (completed is None or r.completed == completed)]
+
+def request_versions(group_name=None):
+    """High-water marks for the delta feed: {database path: current row version}."""
+    marks = {}
+    for pool in request_pools(group_name):
+        row = pool.connection().execute("SELECT version FROM row_versions WHERE name = 'requests'").fetchone()
+        marks[pool.path] = row[0] if row else 0
+    return marks
+
+def get_request_changes(since, group_name=None):
+    """Requests created, edited or commented on after the marks in `since`.
+
+    Returns (changed rows, deleted ids, new marks), or None when tombstones
+    past a mark were pruned and the caller has to reload instead.
+    """
+    changed, deleted, marks = [], set(), {}
+    for pool in request_pools(group_name):
+        conn = pool.connection()
+        mark = since.get(pool.path, 0)
+        row = conn.execute("SELECT version, floor FROM row_versions WHERE name = 'requests'").fetchone()
+        version, floor = row if row else (0, 0)
+        if mark < floor:
+            return None
+        marks[pool.path] = version
+        if version == mark:
+            continue
+        where, params = requests_filter(group_name)
+        changed += fetch_records(Request, f"""
+            SELECT {Request.columns} FROM requests INDEXED BY idx_requests_row_version
+            WHERE row_version > ? AND row_version <= ? AND {where}
+        """, [mark, version] + params, pool=pool)
+        deleted.update(row[0] for row in conn.execute(
+            "SELECT id FROM request_tombstones WHERE row_version > ? AND row_version <= ?", (mark, version)))
+    return changed, deleted, marks
+
+def patch_request_page(rows, changed, deleted, status=None, complete=False):
+    """Apply a delta to a cached board page, keeping newest-first order.
+
+    Only the loaded window is maintained: rows older than the last loaded
+    one are left for "Load more" unless the whole result set is loaded.
+    """
+    oldest = rows[-1].cursor if rows and not complete else None
+    by_id = {req.id: req for req in rows if req.id not in deleted}
+    for req in changed:
+        if status is not None and req.completed != (status == "done"):
+            by_id.pop(req.id, None)
+        elif req.id in by_id or oldest is None or req.cursor > oldest:
+            by_id[req.id] = req
+    return sorted(by_id.values(), key=request_order_key, reverse=True)
+
+def read_counter(counter, group_name=None):
+    """Current value of a COUNTERS entry for one group, or summed over all groups."""
+    total = 0
+    for pool in request_pools(group_name):
+        conn = pool.connection()
         if group_name is not None:
-            cursor.execute("""
-                INSERT INTO requests (agent_name, request_type, identifier, comment, timestamp, group_name) 
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (agent_name, request_type, identifier, comment, timestamp, group_name))
+            row = conn.execute("SELECT value FROM counters WHERE name = ?", (f"{counter}:{group_name}",)).fetchone()
         else:
-            cursor.execute("""
-                INSERT INTO requests (agent_name, request_type, identifier, comment, timestamp) 
-                VALUES (?, ?, ?, ?, ?)
-            """, (agent_name, request_type, identifier, comment, timestamp))
-        
-        request_id = cursor.lastrowid
-        
-        cursor.execute("""
-            INSERT INTO request_comments (request_id, user, comment, timestamp)
-            VALUES (?, ?, ?, ?)
-        """, (request_id, agent_name, f"Request created: {comment}", timestamp))
-        
-        conn.commit()
-        return True
-    finally:
-        conn.close()
-
-def get_requests():
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM requests ORDER BY timestamp DESC")
-        return cursor.fetchall()
-    finally:
-        conn.close()
-
-def search_requests(query):
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        query = f"%{query.lower()}%"
-        cursor.execute("""
-            SELECT * FROM requests 
-            WHERE LOWER(agent_name) LIKE ? 
-            OR LOWER(request_type) LIKE ? 
-            OR LOWER(identifier) LIKE ? 
-            OR LOWER(comment) LIKE ?
-            ORDER BY timestamp DESC
-        """, (query, query, query, query))
-        return cursor.fetchall()
-    finally:
-        conn.close()
+            row = conn.execute("SELECT SUM(value) FROM counters WHERE name >= ? AND name < ?",
+                               (f"{counter}:", f"{counter};")).fetchone()
+        total += (row[0] or 0) if row else 0
+    return total
 
 def update_request_status(request_id, completed):
     if is_killswitch_enabled():
         st.error("System is currently locked. Please contact the developer.")
         return False
         
-    conn = get_db_connection()
-    try:
+    with row_pool(request_id).transaction("requests") as conn:
         cursor = conn.cursor()
-        cursor.execute("UPDATE requests SET completed = ? WHERE id = ?",
-                      (1 if completed else 0, request_id))
-        conn.commit()
-        return True
-    finally:
-        conn.close()
+        cursor.execute("UPDATE requests SET completed = ? WHERE id = ?", (1 if completed else 0, request_id))
+        updated = cursor.execute("SELECT group_name FROM requests WHERE id = ?",
+                                 (request_id,)).fetchone() if cursor.rowcount else None
+    if updated:
+        publish_event("requests", updated[0])
+    return True
+
+# Work queue. An admin claims the oldest open request nobody holds; the
+# claim is a lease that lapses after CLAIM_LEASE_SECONDS, returning the
+# request to the queue if it was neither completed nor released.
+
+CLAIM_LEASE_SECONDS = int(os.environ.get("LYCA_CLAIM_LEASE_SECONDS", "900"))
 
-def add_request_comment(request_id, user, comment):
+def claim_next_request(assignee, group_name=None, lease_seconds=CLAIM_LEASE_SECONDS):
+    """Atomically claim the oldest unclaimed open request; None when the queue is empty.
+
+    One UPDATE ... RETURNING per database file: the pick and the claim
+    happen under the same write lock, so two admins never get the same row.
+    """
+    if is_killswitch_enabled():
+        st.error("System is currently locked. Please contact the developer.")
+        return None
+    now = int(datetime.now(pytz.UTC).timestamp())
+    group_clause = "group_name = ? AND " if group_name is not None else ""
+    params = ([group_name] if group_name is not None else []) + [now - lease_seconds]
+    for pool in request_pools(group_name):
+        with pool.transaction("requests") as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = Request.row_factory
+            claimed = cursor.execute(f"""
+                UPDATE requests SET assignee = ?, claimed_at = ?
+                WHERE id = (
+                    SELECT id FROM requests
+                    WHERE {group_clause}completed = 0 AND claimed_at < ?
+                    ORDER BY ts_epoch, id LIMIT 1
+                )
+                RETURNING {Request.columns}
+            """, [assignee, now] + params).fetchall()
+        if claimed:
+            return publish_event("requests", claimed[0].group_name, claimed[0])
+    return None
+
+def release_request(request_id, assignee):
+    """Hand a claimed request back to the queue before its lease runs out."""
+    with row_pool(request_id).transaction("requests") as conn:
+        released = conn.execute("UPDATE requests SET assignee = NULL, claimed_at = 0 WHERE id = ? AND assignee = ?",
+                                (request_id, assignee)).rowcount > 0
+    return publish_event("requests", None, released)
+
+def get_claimed_requests(assignee, lease_seconds=CLAIM_LEASE_SECONDS):
+    """Open requests `assignee` currently holds, oldest claim first."""
+    cutoff = int(datetime.now(pytz.UTC).timestamp()) - lease_seconds
+    return sorted((req for pool in all_pools() for req in fetch_records(Request, f"""
+        SELECT {Request.columns} FROM requests
+        WHERE assignee = ? AND completed = 0 AND claimed_at >= ?
+    """, (assignee, cutoff), pool=pool)), key=attrgetter("claimed_at"))
+
+def request_ids_by_shard(request_ids):
+    """Group request ids by the shard holding them (None for the main file)."""
+    by_shard = {}
+    for request_id in request_ids:
+        shard = shard_router.shard_for_id(request_id) if shard_router is not None else None
+        by_shard.setdefault(shard, []).append(request_id)
+    return by_shard
+
+def bulk_update_request_status(request_ids, completed):
+    """Complete or reopen many requests: one executemany transaction per database file."""
     if is_killswitch_enabled():
         st.error("System is currently locked. Please contact the developer.")
         return False
-        
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO request_comments (request_id, user, comment, timestamp)
-            VALUES (?, ?, ?, ?)
-        """, (request_id, user, comment, get_casablanca_time()))
-        conn.commit()
-        return True
-    finally:
-        conn.close()
+    value = 1 if completed else 0
+    for shard, ids in request_ids_by_shard(request_ids).items():
+        with (shard.pool if shard else current_pool()).transaction("requests") as conn:
+            conn.executemany("UPDATE requests SET completed = ? WHERE id = ?",
+                             [(value, request_id) for request_id in ids])
+    return publish_event("requests")
+
+def insert_request_comment(conn, request_id, user, comment, timestamp):
+    return conn.execute("""
+        INSERT INTO request_comments (request_id, user, comment, timestamp, ts_epoch)
+        VALUES (?, ?, ?, ?, ?)
+    """, (request_id, user, comment, timestamp, casablanca_to_epoch(timestamp))).lastrowid
+
+def add_request_comment(request_id, user, comment, wait=True):
+    if is_killswitch_enabled():
+        st.error("System is currently locked. Please contact the developer.")
+        return False
+    shard = shard_router.shard_for_id(request_id) if shard_router is not None else None
+    return publish_event("requests", None, queue_write(
+        "request_comments", insert_request_comment, request_id, user, comment,
+        get_casablanca_time(), wait=wait, writer=shard.writer if shard else None))
+
+def insert_request_comments(conn, request_ids, user, comment, timestamp):
+    conn.executemany("""
+        INSERT INTO request_comments (request_id, user, comment, timestamp, ts_epoch)
+        VALUES (?, ?, ?, ?, ?)
+    """, [(request_id, user, comment, timestamp, casablanca_to_epoch(timestamp)) for request_id in request_ids])
+    return len(request_ids)
+
+def bulk_add_request_comment(request_ids, user, comment):
+    """Add one status comment to many requests; returns how many were written.
+
+    Each database file's rows go to its writer as a single executemany write.
+    """
+    if is_killswitch_enabled():
+        st.error("System is currently locked. Please contact the developer.")
+        return False
+    timestamp = get_casablanca_time()
+    futures = [queue_write("request_comments", insert_request_comments, ids, user, comment, timestamp,
+                           wait=False, writer=shard.writer if shard else None)
+               for shard, ids in request_ids_by_shard(request_ids).items()]
+    written = sum(future.result(timeout=WRITE_QUEUE_ACK_TIMEOUT_SECONDS) for future in futures)
+    publish_event("requests")
+    return written
 
 def get_request_comments(request_id):
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT * FROM request_comments 
-            WHERE request_id = ?
-            ORDER BY timestamp ASC
-        """, (request_id,))
-        return cursor.fetchall()
-    finally:
-        conn.close()
-
-def add_mistake(team_leader, agent_name, ticket_id, error_description):
+    return fetch_records(Comment, f"""
+        SELECT {Comment.columns} FROM request_comments 
+        WHERE request_id = ?
+        ORDER BY ts_epoch ASC
+    """, (request_id,), pool=row_pool(request_id))
+
+def get_comments_for_requests(request_ids):
+    """Comments of many requests at once: {request_id: [Comment, ...]}.
+
+    One query per database file holding any of the ids (the ids travel as
+    a single JSON parameter), instead of one query per request.
+    """
+    by_pool = {}
+    for request_id in request_ids:
+        pool = row_pool(request_id)
+        by_pool.setdefault(id(pool), (pool, []))[1].append(request_id)
+    comments = {}
+    for pool, ids in by_pool.values():
+        for comment in fetch_records(Comment, f"""
+            SELECT {Comment.columns} FROM request_comments
+            WHERE request_id IN (SELECT value FROM json_each(?))
+            ORDER BY request_id, ts_epoch ASC
+        """, (json.dumps(ids),), lazy=True, pool=pool):
+            comments.setdefault(comment.request_id, []).append(comment)
+    return comments
+
+def insert_mistake(conn, team_leader, agent_name, ticket_id, error_description, timestamp):
+    return conn.execute("""
+        INSERT INTO mistakes (team_leader, agent_name, ticket_id, error_description, timestamp, ts_epoch)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (team_leader, agent_name, ticket_id, error_description, timestamp, casablanca_to_epoch(timestamp))).lastrowid
+
+def add_mistake(team_leader, agent_name, ticket_id, error_description, wait=True):
     if is_killswitch_enabled():
         st.error("System is currently locked. Please contact the developer.")
         return False
-        
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO mistakes (team_leader, agent_name, ticket_id, error_description, timestamp) 
-            VALUES (?, ?, ?, ?, ?)
-        """, (team_leader, agent_name, ticket_id, error_description, get_casablanca_time()))
-        conn.commit()
-        return True
-    finally:
-        conn.close()
-
-def get_mistakes():
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM mistakes ORDER BY timestamp DESC")
-        return cursor.fetchall()
-    finally:
-        conn.close()
-
-def search_mistakes(query):
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        query = f"%{query.lower()}%"
-        cursor.execute("""
-            SELECT * FROM mistakes 
-            WHERE LOWER(agent_name) LIKE ? 
-            OR LOWER(ticket_id) LIKE ? 
-            OR LOWER(error_description) LIKE ?
-            ORDER BY timestamp DESC
-        """, (query, query, query))
-        return cursor.fetchall()
-    finally:
-        conn.close()
-
-def send_group_message(sender, message, group_name=None):
+    return publish_event("mistakes", None, queue_write(
+        "mistakes", insert_mistake, team_leader, agent_name, ticket_id,
+        error_description, get_casablanca_time(), wait=wait))
+
+MISTAKES_PAGE_SIZE = 50
+MISTAKE_SUMMARY_DAYS = (7, 30, 90)
+
+def mistakes_filter(agent_name=None, team_leader=None, start_date=None, end_date=None, before=None):
+    """WHERE clause and params for the Mistakes Log filters and (ts_epoch, id) cursor."""
+    clauses, params = [], []
+    if agent_name:
+        clauses.append("agent_name = ?")
+        params.append(agent_name)
+    if team_leader:
+        clauses.append("team_leader = ?")
+        params.append(team_leader)
+    if start_date is not None:
+        clauses.append("ts_epoch >= ? AND ts_epoch < ?")
+        params.extend(casablanca_day_epochs(start_date, end_date))
+    if before is not None:
+        clauses.append("(ts_epoch, id) < (?, ?)")
+        params.extend(before)
+    return " AND ".join(clauses) or "1", params
+
+def get_mistakes(lazy=False, agent_name=None, team_leader=None, start_date=None, end_date=None,
+                 before=None, limit=None):
+    """Mistakes newest first, optionally filtered and one keyset page."""
+    where, params = mistakes_filter(agent_name, team_leader, start_date, end_date, before)
+    limit_clause = ""
+    if limit is not None:
+        limit_clause = " LIMIT ?"
+        params.append(limit)
+    return fetch_records(Mistake, f"""
+        SELECT {Mistake.columns} FROM mistakes WHERE {where}
+        ORDER BY ts_epoch DESC, id DESC{limit_clause}
+    """, params, lazy=lazy)
+
+MISTAKE_SEARCH_WHERE = """
+    LOWER(agent_name) LIKE ? 
+    OR LOWER(ticket_id) LIKE ? 
+    OR LOWER(error_description) LIKE ?
+"""
+
+def search_mistakes(query, lazy=False, include_archive=False, agent_name=None, team_leader=None,
+                    start_date=None, end_date=None, before=None, limit=None):
+    """Search live mistakes within the filters; archived matches follow when include_archive is set.
+
+    The text match runs on rows the filters' indexes select, newest first,
+    and stops at `limit`.
+    """
+    where, params = mistakes_filter(agent_name, team_leader, start_date, end_date, before)
+    like = (f"%{query.lower()}%",) * 3
+    params = list(like) + params
+    limit_clause = ""
+    if limit is not None:
+        limit_clause = " LIMIT ?"
+        params.append(limit)
+    results = fetch_records(Mistake, f"""
+        SELECT {Mistake.columns} FROM mistakes 
+        WHERE ({MISTAKE_SEARCH_WHERE}) AND {where}
+        ORDER BY ts_epoch DESC, id DESC{limit_clause}
+    """, params, lazy=lazy and not include_archive)
+    if include_archive:
+        results += search_archived_mistakes(query, agent_name, team_leader, start_date, end_date)
+    return results
+
+def search_archived_mistakes(query, agent_name=None, team_leader=None, start_date=None, end_date=None):
+    """Substring search over the monthly archive files with the Mistakes Log filters."""
+    start, end = casablanca_day_epochs(start_date, end_date) if start_date is not None else (None, None)
+    return [m for m in search_archives(Mistake, "mistakes", MISTAKE_SEARCH_WHERE, (f"%{query.lower()}%",) * 3)
+            if (not agent_name or m.agent_name == agent_name)
+            and (not team_leader or m.team_leader == team_leader)
+            and (start is None or start <= m.ts_epoch < end)]
+
+def mistake_summary(by="agent_name", days=MISTAKE_SUMMARY_DAYS):
+    """Mistake counts per agent (or team_leader) over rolling windows, most first.
+
+    One grouped query over the longest window's ts_epoch range (pinned to
+    that index, so the cost follows the window, not the whole history);
+    returns rows of (name, count for each of `days`).
+    """
+    if by not in ("agent_name", "team_leader"):
+        raise ValueError(f"cannot summarise mistakes by {by!r}")
+    now = int(datetime.now(pytz.UTC).timestamp())
+    windows = sorted(days)
+    counts = ", ".join(f"SUM(ts_epoch >= ?) AS last_{d}" for d in windows[:-1])
+    return get_db_connection().execute(f"""
+        SELECT {by}, {counts + ", " if counts else ""}COUNT(*) AS last_{windows[-1]}
+        FROM mistakes INDEXED BY idx_mistakes_ts_epoch WHERE ts_epoch >= ?
+        GROUP BY {by}
+        ORDER BY last_{windows[-1]} DESC, {by}
+    """, [now - d * 86400 for d in windows[:-1]] + [now - windows[-1] * 86400]).fetchall()
+
+def insert_group_message(conn, sender, message, timestamp, mentions, group_name):
+    message_id = conn.execute("""
+        INSERT INTO group_messages (sender, message, timestamp, ts_epoch, mentions, group_name)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (sender, message, timestamp, casablanca_to_epoch(timestamp), mentions, group_name)).lastrowid
+    insert_mentions(conn, "group", message_id, mentions.split(","))
+    return message_id
+
+def send_group_message(sender, message, group_name=None, wait=True):
     if is_killswitch_enabled() or is_chat_killswitch_enabled():
         st.error("Chat is currently locked. Please contact the developer.")
         return False
-        
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        mentions = re.findall(r'@(\w+)', message)
-        reactions_json = json.dumps({})
-        if group_name is not None:
-            cursor.execute("""
-                INSERT INTO group_messages (sender, message, timestamp, mentions, group_name, reactions) 
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (sender, message, get_casablanca_time(), ','.join(mentions), group_name, reactions_json))
-        else:
-            cursor.execute("""
-                INSERT INTO group_messages (sender, message, timestamp, mentions, reactions) 
-                VALUES (?, ?, ?, ?, ?)
-            """, (sender, message, get_casablanca_time(), ','.join(mentions), reactions_json))
-        conn.commit()
-        return True
-    finally:
-        conn.close()
+    mentions = re.findall(r'@(\w+)', message)
+    result = publish_event("chat", group_name, queue_write(
+        "group_messages", insert_group_message, sender, message, get_casablanca_time(),
+        ','.join(mentions), group_name, wait=wait, writer=group_writer(group_name)))
+    for username in set(mentions):
+        publish_event("mentions", username, result)
+    return result
+
+CHAT_WINDOW = 50
+
+def get_group_messages(group_name=None, after_id=0, limit=CHAT_WINDOW):
+    """A group's newest messages with id > after_id, newest first.
+
+    Ids only grow, in every file (shard ranges sit above the main file's),
+    so a client polling with the last id it saw costs one (group_name, id)
+    index probe per file when nothing is new.
+    """
+    # Harden: Never allow None, empty, or blank group_name to fetch all messages
+    if group_name is None or str(group_name).strip() == "":
+        return []
+    return fetch_merged(
+        Message,
+        f"SELECT {Message.columns} FROM group_messages WHERE group_name = ? AND id > ? ORDER BY id DESC LIMIT ?",
+        (group_name, after_id, limit), pools=group_read_pools(group_name), limit=limit, key=attrgetter("id")
+    )
+
+def poll_group_messages(group_name, after_id=0, limit=CHAT_WINDOW):
+    """(messages the group has, its newest messages with id > after_id), one statement per file.
+
+    The total is the trigger-maintained "messages:<group>" counter read
+    alongside the id probe, so a poller can tell when messages it holds
+    were deleted without a second query.
+    """
+    total, fresh = 0, []
+    columns = ", ".join(f"m.{name}" for name in Message.__slots__)
+    for pool in group_read_pools(group_name):
+        rows = pool.connection().execute(f"""
+            SELECT c.value, {columns}
+            FROM (SELECT COALESCE((SELECT value FROM counters WHERE name = ?), 0) AS value) c
+            LEFT JOIN (
+                SELECT {Message.columns} FROM group_messages
+                WHERE group_name = ? AND id > ? ORDER BY id DESC LIMIT ?
+            ) m ON 1
+        """, (f"messages:{group_name}", group_name, after_id, limit)).fetchall()
+        total += rows[0][0]
+        fresh += [Message(*row[1:]) for row in rows if row[1] is not None]
+    fresh.sort(key=attrgetter("id"), reverse=True)
+    return total, fresh[:limit]
+
+def poll_chat_window(group_name, prefetched=None):
+    """The session's rolling window of a group's latest messages, plus what just arrived.
+
+    Returns (window newest first, new messages). The first poll of a group
+    fills the window and reports nothing as new. The session keeps the
+    group's message total with the window: if the new total is not the old
+    one plus what arrived, messages were deleted (a clear, archival, a
+    cascade) and the window is refilled. `prefetched` is a
+    (group, after_id, total, fresh) poll already run by PageData; it is
+    used when it still matches the window.
+    """
+    if not group_name:
+        return [], []
+    windows = st.session_state.setdefault("chat_windows", {})
+    cached = windows.get(group_name)
+    after_id = cached[1][0].id if cached and cached[1] else 0
+    if prefetched is not None and prefetched[:2] == (group_name, after_id):
+        total, fresh = prefetched[2:]
+    else:
+        total, fresh = poll_group_messages(group_name, after_id=after_id)
+    if cached is None or total != cached[0] + len(fresh):
+        if cached is not None:
+            total, fresh = poll_group_messages(group_name)
+        windows[group_name] = (total, fresh)
+        return fresh, []
+    window = (fresh + cached[1])[:CHAT_WINDOW]
+    windows[group_name] = (total, window)
+    return window, fresh
 
-def get_group_messages(group_name=None):
-    # Harden: Never allow None, empty, or blank group_name to fetch all messages
+def get_new_messages(last_check_time, group_name=None):
+    """Get new messages since last check for the specified group only."""
+    # Never allow None, empty, or blank group_name to fetch all messages
     if group_name is None or str(group_name).strip() == "":
         return []
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM group_messages WHERE group_name = ? ORDER BY timestamp DESC LIMIT 50", (group_name,))
-        rows = cursor.fetchall()
-        messages = []
-        for row in rows:
-            msg = dict(zip([column[0] for column in cursor.description], row))
-            # Parse reactions JSON
-            if 'reactions' in msg and msg['reactions']:
-                try:
-                    msg['reactions'] = json.loads(msg['reactions'])
-                except Exception:
-                    msg['reactions'] = {}
-            else:
-                msg['reactions'] = {}
-            messages.append(msg)
-        return messages
-    finally:
-        conn.close()
+    return fetch_merged(Message, f"""
+        SELECT {Message.columns}
+        FROM group_messages
+        WHERE group_name = ? AND ts_epoch > ?
+        ORDER BY ts_epoch DESC
+    """, (group_name, casablanca_to_epoch(last_check_time)), pools=group_read_pools(group_name))
 
 def add_reaction_to_message(message_id, emoji, username):
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT reactions FROM group_messages WHERE id = ?", (message_id,))
-        row = cursor.fetchone()
-        if not row:
+    """Toggle `username`'s `emoji` on a message; False if the message does not exist."""
+    with row_pool(message_id).transaction("group_messages") as conn:
+        message = conn.execute("SELECT group_name FROM group_messages WHERE id = ?", (message_id,)).fetchone()
+        if message is None:
             return False
-        reactions = json.loads(row[0]) if row[0] else {}
-        if emoji not in reactions:
-            reactions[emoji] = []
-        if username in reactions[emoji]:
-            reactions[emoji].remove(username)  # Toggle off
-            if not reactions[emoji]:
-                del reactions[emoji]
-        else:
-            reactions[emoji].append(username)
-        cursor.execute("UPDATE group_messages SET reactions = ? WHERE id = ?", (json.dumps(reactions), message_id))
-        conn.commit()
-        return True
-    finally:
-        conn.close()
-
-def get_all_users(include_templates=False):
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        if include_templates:
-            cursor.execute("SELECT id, username, role, group_name, break_templates FROM users")
-        else:
-            cursor.execute("SELECT id, username, role, group_name FROM users")
-        return cursor.fetchall()
-    finally:
-        conn.close()
+        if not conn.execute("DELETE FROM message_reactions WHERE message_id = ? AND emoji = ? AND username = ?",
+                            (message_id, emoji, username)).rowcount:
+            conn.execute("INSERT INTO message_reactions (message_id, emoji, username) VALUES (?, ?, ?)",
+                         (message_id, emoji, username))
+    return publish_event("chat", message[0])
+
+def get_reaction_counts(message_ids, username=None):
+    """Reactions of many messages: {message_id: [(emoji, count, reacted by username)]}.
+
+    One grouped query per database file holding any of the ids.
+    """
+    by_pool = {}
+    for message_id in message_ids:
+        pool = row_pool(message_id)
+        by_pool.setdefault(id(pool), (pool, []))[1].append(message_id)
+    counts = {}
+    for pool, ids in by_pool.values():
+        for message_id, emoji, count, mine in pool.connection().execute("""
+            SELECT message_id, emoji, COUNT(*), MAX(username = ?) FROM message_reactions
+            WHERE message_id IN (SELECT value FROM json_each(?))
+            GROUP BY message_id, emoji
+        """, (username, json.dumps(ids))):
+            counts.setdefault(message_id, []).append((emoji, count, bool(mine)))
+    return counts
+
+def get_all_users(lazy=False):
+    return fetch_records(User, f"SELECT {User.columns} FROM users", lazy=lazy)
 
 def add_user(username, password, role, group_name=None, break_templates=None):
     if is_killswitch_enabled():
@@ -581,14 +2214,8 @@ def add_user(username, password, role, group_name=None, break_templates=None):
         st.error("Password must be at least 8 characters, include uppercase, lowercase, digit, and special character.")
         return False
     import sqlite3
-    conn = get_db_connection()
-    try:
+    with db_transaction("users") as conn:
         cursor = conn.cursor()
-        # MIGRATION: Add break_templates column if not exists
-        try:
-            cursor.execute("ALTER TABLE users ADD COLUMN break_templates TEXT")
-        except Exception:
-            pass
         try:
             if group_name is not None:
                 if break_templates is not None:
@@ -606,12 +2233,9 @@ def add_user(username, password, role, group_name=None, break_templates=None):
                 else:
                     cursor.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
                                    (username, hash_password(password), role))
-            conn.commit()
             return True
         except sqlite3.IntegrityError:
             return "exists"
-    finally:
-        conn.close()
 
 
 def delete_user(user_id):
@@ -619,14 +2243,10 @@ def delete_user(user_id):
         st.error("System is currently locked. Please contact the developer.")
         return False
         
-    conn = get_db_connection()
-    try:
+    with db_transaction("users") as conn:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-        conn.commit()
         return True
-    finally:
-        conn.close()
         
 def reset_password(username, new_password):
     """Reset a user's password"""
@@ -650,229 +2270,188 @@ def reset_password(username, new_password):
         st.error("Password must be at least 8 characters, include uppercase, lowercase, digit, and special character.")
         return False
         
-    conn = get_db_connection()
-    try:
+    with db_transaction("users") as conn:
         cursor = conn.cursor()
         hashed_password = hash_password(new_password)
         cursor.execute("UPDATE users SET password = ? WHERE username = ?", 
                      (hashed_password, username))
-        conn.commit()
         return True
-    finally:
-        conn.close()
 
 def add_hold_image(uploader, image_data):
     if is_killswitch_enabled():
         st.error("System is currently locked. Please contact the developer.")
         return False
         
-    conn = get_db_connection()
-    try:
+    with db_transaction("hold_images") as conn:
         cursor = conn.cursor()
+        timestamp = get_casablanca_time()
         cursor.execute("""
-            INSERT INTO hold_images (uploader, image_data, timestamp) 
-            VALUES (?, ?, ?)
-        """, (uploader, image_data, get_casablanca_time()))
-        conn.commit()
+            INSERT INTO hold_images (uploader, image_data, timestamp, ts_epoch)
+            VALUES (?, ?, ?, ?)
+        """, (uploader, image_data, timestamp, casablanca_to_epoch(timestamp)))
         return True
-    finally:
-        conn.close()
 
-def get_hold_images():
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM hold_images ORDER BY timestamp DESC")
-        return cursor.fetchall()
-    finally:
-        conn.close()
+def get_hold_images(lazy=False):
+    return fetch_records(HoldImage, f"SELECT {HoldImage.columns} FROM hold_images ORDER BY ts_epoch DESC", lazy=lazy)
 
 def clear_hold_images():
     if is_killswitch_enabled():
         st.error("System is currently locked. Please contact the developer.")
         return False
         
-    conn = get_db_connection()
-    try:
+    with db_transaction("hold_images") as conn:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM hold_images")
-        conn.commit()
         return True
-    finally:
-        conn.close()
 
 def clear_all_requests():
     if is_killswitch_enabled():
         st.error("System is currently locked. Please contact the developer.")
         return False
         
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM requests")
-        cursor.execute("DELETE FROM request_comments")
-        conn.commit()
-        return True
-    finally:
-        conn.close()
+    for pool in all_pools():
+        with pool.transaction("requests") as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM requests")
+            cursor.execute("DELETE FROM request_comments")
+    return publish_event("requests")
 
 def clear_all_mistakes():
     if is_killswitch_enabled():
         st.error("System is currently locked. Please contact the developer.")
         return False
         
-    conn = get_db_connection()
-    try:
+    with db_transaction("mistakes") as conn:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM mistakes")
-        conn.commit()
-        return True
-    finally:
-        conn.close()
+    return publish_event("mistakes")
 
 def clear_all_group_messages():
     if is_killswitch_enabled():
         st.error("System is currently locked. Please contact the developer.")
         return False
         
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM group_messages")
-        conn.commit()
-        return True
-    finally:
-        conn.close()
+    for pool in all_pools():
+        with pool.transaction("group_messages") as conn:
+            conn.execute("DELETE FROM group_messages")
+    return publish_event("chat")
+
+def insert_late_login(conn, agent_name, presence_time, login_time, reason, timestamp):
+    return conn.execute("""
+        INSERT INTO late_logins (agent_name, presence_time, login_time, reason, timestamp, ts_epoch)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (agent_name, presence_time, login_time, reason, timestamp, casablanca_to_epoch(timestamp))).lastrowid
 
-def add_late_login(agent_name, presence_time, login_time, reason):
+def add_late_login(agent_name, presence_time, login_time, reason, wait=True):
     if is_killswitch_enabled():
         st.error("System is currently locked. Please contact the developer.")
         return False
-        
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO late_logins (agent_name, presence_time, login_time, reason, timestamp) 
-            VALUES (?, ?, ?, ?, ?)
-        """, (agent_name, presence_time, login_time, reason, get_casablanca_time()))
-        conn.commit()
-        return True
-    finally:
-        conn.close()
-
-def get_late_logins():
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM late_logins ORDER BY timestamp DESC")
-        return cursor.fetchall()
-    finally:
-        conn.close()
-
-def add_quality_issue(agent_name, issue_type, timing, mobile_number, product):
+    return publish_event("late_logins", None, queue_write(
+        "late_logins", insert_late_login, agent_name, presence_time, login_time,
+        reason, get_casablanca_time(), wait=wait))
+
+def date_range_filter(start_date=None, end_date=None):
+    """WHERE clause and params keeping rows on the given Casablanca days (or all rows)."""
+    if start_date is None:
+        return "1", ()
+    return "ts_epoch >= ? AND ts_epoch < ?", casablanca_day_epochs(start_date, end_date)
+
+def get_late_logins(lazy=False, start_date=None, end_date=None):
+    """Late logins newest first; a date range also reads the archived months it spans."""
+    where, params = date_range_filter(start_date, end_date)
+    rows = fetch_records(LateLogin, f"SELECT {LateLogin.columns} FROM late_logins WHERE {where} ORDER BY ts_epoch DESC",
+                         params, lazy=lazy and start_date is None)
+    if start_date is not None:
+        rows += search_archives(LateLogin, "late_logins", where, params, archive_months_between(start_date, end_date))
+    return rows
+
+def insert_quality_issue(conn, agent_name, issue_type, timing, mobile_number, product, timestamp):
+    return conn.execute("""
+        INSERT INTO quality_issues (agent_name, issue_type, timing, mobile_number, product, timestamp, ts_epoch)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (agent_name, issue_type, timing, mobile_number, product, timestamp, casablanca_to_epoch(timestamp))).lastrowid
+
+def add_quality_issue(agent_name, issue_type, timing, mobile_number, product, wait=True):
     if is_killswitch_enabled():
         st.error("System is currently locked. Please contact the developer.")
         return False
-        
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO quality_issues (agent_name, issue_type, timing, mobile_number, product, timestamp) 
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (agent_name, issue_type, timing, mobile_number, product, get_casablanca_time()))
-        conn.commit()
-        return True
-    finally:
-        conn.close()
+    return publish_event("quality_issues", None, queue_write(
+        "quality_issues", insert_quality_issue, agent_name, issue_type, timing,
+        mobile_number, product, get_casablanca_time(), wait=wait))
 
-def get_quality_issues():
-    conn = get_db_connection()
+def get_quality_issues(start_date=None, end_date=None):
+    """Quality issues newest first; a date range also reads the archived months it spans."""
+    where, params = date_range_filter(start_date, end_date)
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM quality_issues ORDER BY timestamp DESC")
-        return cursor.fetchall()
+        rows = fetch_records(QualityIssue, f"SELECT {QualityIssue.columns} FROM quality_issues WHERE {where} ORDER BY ts_epoch DESC",
+                             params)
+        if start_date is not None:
+            rows += search_archives(QualityIssue, "quality_issues", where, params, archive_months_between(start_date, end_date))
+        return rows
     except Exception as e:
         st.error(f"Error fetching quality issues: {str(e)}")
-    finally:
-        conn.close()
 
-def add_midshift_issue(agent_name, issue_type, start_time, end_time):
+def insert_midshift_issue(conn, agent_name, issue_type, start_time, end_time, timestamp):
+    return conn.execute("""
+        INSERT INTO midshift_issues (agent_name, issue_type, start_time, end_time, timestamp, ts_epoch)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (agent_name, issue_type, start_time, end_time, timestamp, casablanca_to_epoch(timestamp))).lastrowid
+
+def add_midshift_issue(agent_name, issue_type, start_time, end_time, wait=True):
     if is_killswitch_enabled():
         st.error("System is currently locked. Please contact the developer.")
         return False
-        
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO midshift_issues (agent_name, issue_type, start_time, end_time, timestamp) 
-            VALUES (?, ?, ?, ?, ?)
-        """, (agent_name, issue_type, start_time, end_time, get_casablanca_time()))
-        conn.commit()
-        return True
-    finally:
-        conn.close()
+    return publish_event("midshift_issues", None, queue_write(
+        "midshift_issues", insert_midshift_issue, agent_name, issue_type,
+        start_time, end_time, get_casablanca_time(), wait=wait))
 
-def get_midshift_issues():
-    conn = get_db_connection()
+def get_midshift_issues(start_date=None, end_date=None):
+    """Mid-shift issues newest first; a date range also reads the archived months it spans."""
+    where, params = date_range_filter(start_date, end_date)
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM midshift_issues ORDER BY timestamp DESC")
-        return cursor.fetchall()
+        rows = fetch_records(MidshiftIssue, f"SELECT {MidshiftIssue.columns} FROM midshift_issues WHERE {where} ORDER BY ts_epoch DESC",
+                             params)
+        if start_date is not None:
+            rows += search_archives(MidshiftIssue, "midshift_issues", where, params, archive_months_between(start_date, end_date))
+        return rows
     except Exception as e:
         st.error(f"Error fetching mid-shift issues: {str(e)}")
-    finally:
-        conn.close()
 
 def clear_late_logins():
     if is_killswitch_enabled():
         st.error("System is currently locked. Please contact the developer.")
         return False
         
-    conn = get_db_connection()
     try:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM late_logins")
-        conn.commit()
-        return True
+        with db_transaction("late_logins") as conn:
+            conn.execute("DELETE FROM late_logins")
+        return publish_event("late_logins")
     except Exception as e:
         st.error(f"Error clearing late logins: {str(e)}")
-    finally:
-        conn.close()
 
 def clear_quality_issues():
     if is_killswitch_enabled():
         st.error("System is currently locked. Please contact the developer.")
         return False
         
-    conn = get_db_connection()
     try:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM quality_issues")
-        conn.commit()
-        return True
+        with db_transaction("quality_issues") as conn:
+            conn.execute("DELETE FROM quality_issues")
+        return publish_event("quality_issues")
     except Exception as e:
         st.error(f"Error clearing quality issues: {str(e)}")
-    finally:
-        conn.close()
 
 def clear_midshift_issues():
     if is_killswitch_enabled():
         st.error("System is currently locked. Please contact the developer.")
         return False
         
-    conn = get_db_connection()
     try:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM midshift_issues")
-        conn.commit()
-        return True
+        with db_transaction("midshift_issues") as conn:
+            conn.execute("DELETE FROM midshift_issues")
+        return publish_event("midshift_issues")
     except Exception as e:
         st.error(f"Error clearing mid-shift issues: {str(e)}")
-    finally:
-        conn.close()
 
 def send_vip_message(sender, message):
     """Send a message in the VIP-only chat"""
@@ -884,28 +2463,340 @@ def send_vip_message(sender, message):
         st.error("Only VIP users can send messages in this chat.")
         return False
         
-    conn = get_db_connection()
-    try:
+    with db_transaction("vip_messages") as conn:
         cursor = conn.cursor()
         mentions = re.findall(r'@(\w+)', message)
+        timestamp = get_casablanca_time()
         cursor.execute("""
-            INSERT INTO vip_messages (sender, message, timestamp, mentions) 
-            VALUES (?, ?, ?, ?)
-        """, (sender, message, get_casablanca_time(), ','.join(mentions)))
-        conn.commit()
-        return True
-    finally:
-        conn.close()
+            INSERT INTO vip_messages (sender, message, timestamp, ts_epoch, mentions)
+            VALUES (?, ?, ?, ?, ?)
+        """, (sender, message, timestamp, casablanca_to_epoch(timestamp), ','.join(mentions)))
+        insert_mentions(conn, "vip", cursor.lastrowid, mentions)
+    for username in set(mentions):
+        publish_event("mentions", username)
+    return True
 
 def get_vip_messages():
     """Get messages from the VIP-only chat"""
-    conn = get_db_connection()
+    return fetch_records(VipMessage, f"SELECT {VipMessage.columns} FROM vip_messages ORDER BY ts_epoch DESC LIMIT 50")
+
+def get_mentions(username, channel="group", after_id=0, limit=CHAT_WINDOW):
+    """Messages in `channel` ("group" or "vip") that mention `username`, id > after_id, newest first.
+
+    A primary-key range on message_mentions per database file; chat
+    history itself is only touched for the matching rows.
+    """
+    if channel == "group":
+        table, record_cls, pools = "group_messages", Message, all_pools()
+    else:
+        table, record_cls, pools = "vip_messages", VipMessage, [current_pool()]
+    columns = ", ".join(f"m.{name}" for name in record_cls.__slots__)
+    return fetch_merged(record_cls, f"""
+        SELECT {columns} FROM message_mentions mm JOIN {table} m ON m.id = mm.message_id
+        WHERE mm.username = ? AND mm.channel = ? AND mm.message_id > ?
+        ORDER BY mm.message_id DESC LIMIT ?
+    """, (username, channel, after_id, limit), pools=pools, limit=limit, key=attrgetter("id"))
+
+# Query plan regression check: run every read path against the live schema,
+# capture the SQL it issues and fail on full table scans or temp-table sorts.
+# Scans that are the point of the query (listing every user, LIKE search)
+# and sorts that cannot come from an index (ranking by an aggregate) are
+# allowed explicitly.
+
+MISTAKE_SUMMARY_SORTS = ("USE TEMP B-TREE FOR GROUP BY", "USE TEMP B-TREE FOR ORDER BY")
+
+def query_plan_probes():
+    """(label, function, args, allowed scans) for each read path.
+
+    Allowed scans are table names, or a full plan detail such as
+    "USE TEMP B-TREE FOR ORDER BY" for a sort the query cannot avoid.
+    """
+    return [
+        ("authenticate", authenticate, ("probe", "probe"), ()),
+        ("SettingsCache.refresh", system_settings.refresh, (), ()),
+        ("get_requests", get_requests, (), ()),
+        ("get_requests page", get_requests, (False, "probe", "open", (0, 0), 50), ()),
+        ("get_requests page (all groups)", get_requests, (False, None, "done", (0, 0), 50), ()),
+        ("get_claimed_requests", get_claimed_requests, ("probe",), ()),
+        ("search_requests", search_requests, ("probe",), ("requests",)),
+        ("get_request_comments", get_request_comments, (0,), ()),
+        ("get_comments_for_requests", get_comments_for_requests, ([1, 2, 3],), ()),
+        ("get_reaction_counts", get_reaction_counts, ([1, 2, 3], "probe"), ()),
+        ("get_mistakes", get_mistakes, (), ()),
+        ("get_mistakes page", get_mistakes, (False, None, None, None, None, (0, 0), 50), ()),
+        ("get_mistakes by agent", get_mistakes, (False, "probe", None, datetime(2000, 1, 1).date(), None, None, 50), ()),
+        ("get_mistakes by team leader", get_mistakes, (False, None, "probe", None, None, (0, 0), 50), ()),
+        ("search_mistakes", search_mistakes, ("probe",), ("mistakes",)),
+        ("get_group_messages", get_group_messages, ("probe",), ()),
+        ("get_new_messages", get_new_messages, ("2000-01-01 00:00:00", "probe"), ()),
+        ("get_all_users", get_all_users, (), ("users",)),
+        ("get_hold_images", get_hold_images, (), ()),
+        ("get_late_logins", get_late_logins, (), ()),
+        ("get_late_logins by date", get_late_logins, (False, datetime(2000, 1, 1).date()), ()),
+        ("get_quality_issues", get_quality_issues, (), ()),
+        ("get_quality_issues by date", get_quality_issues, (datetime(2000, 1, 1).date(),), ()),
+        ("get_midshift_issues", get_midshift_issues, (), ()),
+        ("get_midshift_issues by date", get_midshift_issues, (datetime(2000, 1, 1).date(),), ()),
+        ("get_vip_messages", get_vip_messages, (), ()),
+        ("get_mentions", get_mentions, ("probe",), ()),
+        ("get_mentions vip", get_mentions, ("probe", "vip", 0), ()),
+        ("poll_group_messages", poll_group_messages, ("probe",), ("c", "m")),
+        ("read_counter", read_counter, ("requests", "probe"), ()),
+        ("read_counter (all groups)", read_counter, ("requests",), ()),
+        ("request_versions", request_versions, (), ()),
+        ("get_request_changes", get_request_changes, ({}, "probe"), ()),
+        ("get_request_changes (all groups)", get_request_changes, ({},), ()),
+        # A lease longer than the epoch makes the claim match nothing, so
+        # the probe plans the UPDATE without claiming a real request.
+        ("claim_next_request", claim_next_request, ("probe", "probe", 10 ** 12), ()),
+        ("claim_next_request (all groups)", claim_next_request, ("probe", None, 10 ** 12), ()),
+        # Grouping a ts_epoch range and ranking by count both need a temp
+        # B-tree; an index in name order would read the whole history instead.
+        ("mistake_summary", mistake_summary, (), MISTAKE_SUMMARY_SORTS),
+        ("mistake_summary by team leader", mistake_summary, ("team_leader",), MISTAKE_SUMMARY_SORTS),
+    ]
+
+def find_plan_problems(conn, sql, allowed_scans=()):
+    """Return the EXPLAIN QUERY PLAN details that indicate a scan or sort."""
+    problems = []
+    for row in conn.execute("EXPLAIN QUERY PLAN " + sql):
+        detail = row[-1]
+        if detail.startswith("USE TEMP B-TREE"):
+            if detail not in allowed_scans:
+                problems.append(detail)
+        elif detail.startswith("SCAN ") and " USING " not in detail and detail != "SCAN CONSTANT ROW" \
+                and " VIRTUAL TABLE " not in detail:  # virtual tables (json_each) plan their own access
+            if detail.split()[1] not in allowed_scans:
+                problems.append(detail)
+    return problems
+
+def check_query_plans():
+    """Return (label, sql, plan detail) for every query that would scan or sort.
+
+    Statements are traced on this thread's connection to every database
+    file, so shard queries are checked against the shard they ran on.
+    """
+    conns = [pool.connection() for pool in all_pools()]
+    problems = []
+    for label, func, args, allowed_scans in query_plan_probes():
+        statements = []
+        for conn in conns:
+            conn.set_trace_callback(lambda sql, conn=conn: statements.append((conn, sql)))
+        try:
+            func(*args)
+        finally:
+            for conn in conns:
+                conn.set_trace_callback(None)
+        for conn, sql in statements:
+            if not sql.lstrip().upper().startswith(("SELECT", "WITH", "UPDATE", "DELETE")):
+                continue
+            if "'main'." in sql:  # FTS5's own statements on its shadow tables
+                continue
+            for detail in find_plan_problems(conn, sql, allowed_scans):
+                problems.append((label, " ".join(sql.split()), detail))
+    return problems
+
+# Archival. Rows older than ARCHIVE_AFTER_DAYS move out of the hot tables
+# into one SQLite file per month (data/archive/YYYY-MM.db), which is only
+# ATTACHed while rows are moved or an archive search runs.
+
+ARCHIVE_DIR = os.path.join("data", "archive")
+ARCHIVE_AFTER_DAYS = int(os.environ.get("LYCA_ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_INTERVAL_HOURS = float(os.environ.get("LYCA_ARCHIVE_INTERVAL_HOURS", "24"))
+# Table -> extra condition a row must meet to be archived. Open requests
+# stay live however old they are; their comments move with the request.
+ARCHIVED_TABLES = {
+    "requests": "completed = 1",
+    "mistakes": "1",
+    "group_messages": "1",
+    "late_logins": "1",
+    "quality_issues": "1",
+    "midshift_issues": "1",
+}
+# Table -> (child table, parent id column) moved along with its rows
+ARCHIVED_CHILDREN = {
+    "requests": ("request_comments", "request_id"),
+    "group_messages": ("message_reactions", "message_id"),
+}
+
+def archive_path(month):
+    return os.path.join(ARCHIVE_DIR, f"{month}.db")
+
+def archive_months():
+    """Months that have an archive file, newest first."""
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    return sorted((name[:-3] for name in os.listdir(ARCHIVE_DIR)
+                   if re.fullmatch(r"\d{4}-\d{2}\.db", name)), reverse=True)
+
+@contextmanager
+def attached_archive(conn, month):
+    """ATTACH one month's archive as `archive` (cannot be used inside a transaction)."""
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    conn.execute("ATTACH DATABASE ? AS archive", (archive_path(month),))
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM vip_messages ORDER BY timestamp DESC LIMIT 50")
-        return cursor.fetchall()
+        yield conn
     finally:
-        conn.close()
+        conn.execute("DETACH DATABASE archive")
+
+def ensure_archive_table(conn, table):
+    """Create `archive.<table>` with the live schema, adding columns added since."""
+    existing = {row[1] for row in conn.execute(f"PRAGMA archive.table_info({table})")}
+    if not existing:
+        sql = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                           (table,)).fetchone()[0]
+        conn.execute(re.sub(r"^CREATE TABLE (IF NOT EXISTS )?", "CREATE TABLE archive.", sql))
+        if "ts_epoch" in table_columns(conn, table):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS archive.idx_{table}_ts_epoch ON {table}(ts_epoch)")
+        return
+    for column in conn.execute(f"PRAGMA main.table_info({table})").fetchall():
+        if column[1] not in existing:
+            conn.execute(f"ALTER TABLE archive.{table} ADD COLUMN {column[1]} {column[2]}")
+
+def archive_old_rows(days=ARCHIVE_AFTER_DAYS):
+    """Move rows older than `days` into their monthly archive; returns {table: rows moved}.
+
+    Shards archive into the same monthly files; their id ranges keep the
+    archived rows distinct.
+    """
+    cutoff = int((datetime.now(pytz.UTC) - timedelta(days=days)).timestamp())
+    moved = {}
+    for pool in all_pools():
+        pool_moved = archive_rows_from(pool, cutoff)
+        if pool_moved.get("requests"):
+            prune_request_tombstones(pool)
+        for table, count in pool_moved.items():
+            moved[table] = moved.get(table, 0) + count
+    return moved
+
+def prune_request_tombstones(pool):
+    """Drop delta-feed tombstones; sessions behind the new floor reload their page."""
+    with pool.transaction("requests") as conn:
+        conn.execute("DELETE FROM request_tombstones")
+        conn.execute("UPDATE row_versions SET floor = version WHERE name = 'requests'")
+
+def archive_rows_from(pool, cutoff):
+    """Archive one database file's rows with ts_epoch < cutoff.
+
+    Each month is moved in one transaction. Rows are copied with INSERT OR
+    IGNORE before being deleted, so a crash between the archive and the
+    live commit leaves duplicates to skip on the next run, never a loss.
+    """
+    conn = pool.connection()
+    tables = {table: condition for table, condition in ARCHIVED_TABLES.items() if table_columns(conn, table)}
+    months = set()
+    for table, condition in tables.items():
+        months.update(row[0] for row in conn.execute(
+            f"SELECT DISTINCT substr(timestamp, 1, 7) FROM {table} WHERE ts_epoch < ? AND {condition}",
+            (cutoff,)))
+    moved = {}
+    for month in sorted(m for m in months if m):
+        with attached_archive(conn, month):
+            with pool.transaction("archive"):
+                for table, condition in tables.items():
+                    where = f"ts_epoch < ? AND substr(timestamp, 1, 7) = ? AND {condition}"
+                    params = (cutoff, month)
+                    ensure_archive_table(conn, table)
+                    if table in ARCHIVED_CHILDREN:
+                        child, parent_id = ARCHIVED_CHILDREN[table]
+                        ensure_archive_table(conn, child)
+                        child_columns = ", ".join(table_columns(conn, child))
+                        conn.execute(f"""
+                            INSERT OR IGNORE INTO archive.{child} ({child_columns})
+                            SELECT {child_columns} FROM main.{child}
+                            WHERE {parent_id} IN (SELECT id FROM main.{table} WHERE {where})
+                        """, params)
+                        conn.execute(f"""
+                            DELETE FROM main.{child}
+                            WHERE {parent_id} IN (SELECT id FROM main.{table} WHERE {where})
+                        """, params)
+                    columns = ", ".join(table_columns(conn, table))
+                    conn.execute(f"""
+                        INSERT OR IGNORE INTO archive.{table} ({columns})
+                        SELECT {columns} FROM main.{table} WHERE {where}
+                    """, params)
+                    count = conn.execute(f"DELETE FROM main.{table} WHERE {where}", params).rowcount
+                    if count:
+                        moved[table] = moved.get(table, 0) + count
+    return moved
+
+def archive_months_between(start_date, end_date=None):
+    """Archive month names ("YYYY-MM") overlapping the days start_date..end_date."""
+    months = set()
+    month = start_date.replace(day=1)
+    while month <= (end_date or start_date):
+        months.add(month.strftime("%Y-%m"))
+        month = (month + timedelta(days=32)).replace(day=1)
+    return months
+
+def search_archives(record_cls, table, where, params=(), months=None, limit=None):
+    """Run a search across the monthly archives (all, or just `months`), newest month first."""
+    conn = get_db_connection()
+    results = []
+    for month in archive_months():
+        if months is not None and month not in months:
+            continue
+        if limit is not None and len(results) >= limit:
+            break
+        with attached_archive(conn, month):
+            if not conn.execute("SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = ?",
+                                (table,)).fetchone():
+                continue
+            ensure_archive_table(conn, table)  # Older files may lack newer columns
+            results.extend(fetch_records(record_cls, f"""
+                SELECT {record_cls.columns} FROM archive.{table}
+                WHERE {where}
+                ORDER BY timestamp DESC
+                {"LIMIT " + str(limit - len(results)) if limit is not None else ""}
+            """, params))
+    return results
+
+def get_archived_group_messages(group_name, limit=CHAT_WINDOW):
+    """A group's newest archived chat messages, newest first (all older than the live chat)."""
+    if group_name is None or str(group_name).strip() == "":
+        return []
+    return search_archives(Message, "group_messages", "group_name = ?", (group_name,), limit=limit)
+
+def archive_stats():
+    """Per-month archive file sizes in bytes, newest first."""
+    return [(month, os.path.getsize(archive_path(month))) for month in archive_months()]
+
+class RollingArchiver(threading.Thread):
+    """Background thread running archive_old_rows() every ARCHIVE_INTERVAL_HOURS."""
+
+    def __init__(self, pool, interval_hours=ARCHIVE_INTERVAL_HOURS, days=ARCHIVE_AFTER_DAYS):
+        super().__init__(name="db-archiver", daemon=True)
+        self.db_pool = pool
+        self.interval = interval_hours * 3600
+        self.days = days
+        self._stop_event = threading.Event()
+        self.last_run = None
+        self.last_moved = {}
+        self.last_error = None
+
+    def run(self):
+        while True:
+            try:
+                self.last_moved = archive_old_rows(self.days)
+                self.last_error = None
+            except sqlite3.Error as e:
+                self.last_error = str(e)  # Retried on the next tick
+            self.last_run = get_casablanca_time()
+            if self._stop_event.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stop_event.set()
+
+@st.cache_resource
+def get_archiver():
+    """Start the rolling archiver once per process (LYCA_ARCHIVE_INTERVAL_HOURS=0 disables it)."""
+    if ARCHIVE_INTERVAL_HOURS <= 0:
+        return None
+    archiver = RollingArchiver(get_connection_pool())
+    archiver.start()
+    atexit.register(archiver.stop)
+    return archiver
 
 # --------------------------
 # Break Scheduling Functions (from first code)
@@ -1039,7 +2930,7 @@ def save_break_data():
                                 pass
                     return False
             
-            return True
+            return publish_event("bookings")
             
         except Exception as e:
             st.error(f"Error during file operations: {str(e)}")
@@ -1182,7 +3073,8 @@ def clear_all_bookings():
         # Force session state refresh
         st.session_state.last_request_count = 0
         st.session_state.last_mistake_count = 0
-        st.session_state.last_message_ids = []
+        st.session_state.chat_windows = {}
+        st.session_state.mention_marks = None
         
         return True
     except Exception as e:
@@ -1516,6 +3408,37 @@ def check_break_conflicts(selected_breaks):
     
     return None
 
+def render_break_reminder(break_times, now_casa):
+    """Browser notification 5 minutes before each of today's break times."""
+    import streamlit.components.v1 as components
+    js_break = f"""
+    <script>
+    const breakTimes = {json.dumps(break_times)};
+    const serverTimeISO = '{now_casa.isoformat()}';
+    const keyPrefix = 'notified_break_sidebar_';
+    (function() {{
+        const now = new Date(serverTimeISO);
+        const today = now.toISOString().split('T')[0];
+        breakTimes.forEach(bt => {{
+            const [h,m] = bt.split(':');
+            const bTime = new Date(now.getFullYear(), now.getMonth(), now.getDate(), h, m, 0);
+            const diffMin = Math.floor((bTime - now) / 60000);
+            const storageKey = keyPrefix + today + '_' + bt;
+            if (diffMin >= 4 && diffMin < 5 && !localStorage.getItem(storageKey)) {{
+                const notify = () => new Notification('Break Reminder', {{ body: `Your break starts in 5 minutes at ${{bt}}.` }});
+                if (Notification.permission === 'granted') {{
+                    notify();
+                    localStorage.setItem(storageKey,'1');
+                }} else if (Notification.permission !== 'denied') {{
+                    Notification.requestPermission().then(p => {{ if (p==='granted') {{ notify(); localStorage.setItem(storageKey,'1'); }} }});
+                }}
+            }}
+        }});
+    }})();
+    </script>
+    """
+    components.html(js_break, height=0)
+
 def refresh_break_data():
     """Refresh break data from the database files"""
     try:
@@ -1794,23 +3717,13 @@ def agent_break_dashboard():
     # Determine agent's assigned templates
     agent_templates = []
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        # Defensive: Check if break_templates column exists
-        cursor.execute("PRAGMA table_info(users)")
-        columns = [row[1] for row in cursor.fetchall()]
-        if "break_templates" in columns:
-            cursor.execute("SELECT break_templates FROM users WHERE username = ?", (agent_id,))
-            row = cursor.fetchone()
-            if row and row[0]:
-                agent_templates = [t.strip() for t in row[0].split(',') if t.strip()]
+        cursor = get_db_connection().cursor()
+        cursor.execute("SELECT break_templates FROM users WHERE username = ?", (agent_id,))
+        row = cursor.fetchone()
+        if row and row[0]:
+            agent_templates = [t.strip() for t in row[0].split(',') if t.strip()]
     except Exception:
         agent_templates = []
-    finally:
-        try:
-            conn.close()
-        except:
-            pass
 
     # Step 1: Template Selection
     if not st.session_state.selected_template_name:
@@ -2025,13 +3938,10 @@ def agent_break_dashboard():
 def is_vip_user(username):
     """Check if a user has VIP status"""
     conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT is_vip FROM users WHERE username = ?", (username,))
-        result = cursor.fetchone()
-        return bool(result[0]) if result else False
-    finally:
-        conn.close()
+    cursor = conn.cursor()
+    cursor.execute("SELECT is_vip FROM users WHERE username = ?", (username,))
+    result = cursor.fetchone()
+    return bool(result[0]) if result else False
 
 def is_sequential(digits, step=1):
     """Check if digits form a sequential pattern with given step"""
@@ -2198,15 +4108,67 @@ def set_vip_status(username, is_vip):
     """Set or remove VIP status for a user"""
     if not username:
         return False
-    conn = get_db_connection()
-    try:
+    with db_transaction("users") as conn:
         cursor = conn.cursor()
         cursor.execute("UPDATE users SET is_vip = ? WHERE username = ?", 
                       (1 if is_vip else 0, username))
-        conn.commit()
         return True
-    finally:
-        conn.close()
+
+# --------------------------
+# Command Line Tools
+# --------------------------
+# `python "USA FORM (1).py" <command>` runs maintenance tasks without the UI.
+
+def cli_check_query_plans(args):
+    init_db()
+    problems = check_query_plans()
+    for label, sql, detail in problems:
+        print(f"{label}: {detail}\n    {sql}")
+    print(f"{len(problems)} query plan problem(s) found")
+    return 1 if problems else 0
+
+def cli_archive(args):
+    init_db()
+    days = int(args[0]) if args else ARCHIVE_AFTER_DAYS
+    moved = archive_old_rows(days)
+    for table, count in sorted(moved.items()):
+        print(f"{table}: {count} row(s) archived")
+    print(f"Archived rows older than {days} day(s) into {ARCHIVE_DIR}")
+    return 0
+
+def cli_import_requests(args):
+    """import-requests FILE.csv [GROUP]: bad rows go to FILE.rejects.csv."""
+    if not args:
+        print("usage: import-requests FILE.csv [GROUP]")
+        return 2
+    init_db()
+    path = args[0]
+    reject_path = os.path.splitext(path)[0] + ".rejects.csv"
+    with open(path, newline="", encoding="utf-8-sig") as source, \
+            open(reject_path, "w", newline="", encoding="utf-8") as reject_file:
+        result = import_requests_csv(source, reject_file, group_name=args[1] if len(args) > 1 else None,
+                                     progress=lambda imported, rejected: print(
+                                         f"\r{imported} imported, {rejected} rejected", end="", flush=True))
+    if result is False:
+        os.remove(reject_path)
+        print("System is currently locked (killswitch enabled); nothing was imported.")
+        return 1
+    print(f"\nImported {result['imported']} request(s) in {result['seconds']:.1f}s "
+          f"({result['rows_per_second']:.0f} rows/s)")
+    if result["rejected"]:
+        print(f"{result['rejected']} row(s) rejected, see {reject_path}")
+    else:
+        os.remove(reject_path)
+    return 0
+
+CLI_COMMANDS = {
+    "check-query-plans": cli_check_query_plans,
+    "archive": cli_archive,
+    "import-requests": cli_import_requests,
+}
+
+if __name__ == "__main__" and len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS:
+    sys.exit(CLI_COMMANDS[sys.argv[1]](sys.argv[2:]))
 
 # --------------------------
 # Streamlit App
@@ -2747,10 +4709,12 @@ if "authenticated" not in st.session_state:
         "current_section": "requests",
         "last_request_count": 0,
         "last_mistake_count": 0,
-        "last_message_ids": []
+        "chat_windows": {},
+        "mention_marks": None
     })
 
 init_db()
+get_archiver()
 init_break_session_state()
 
 if not st.session_state.authenticated:
@@ -2772,9 +4736,10 @@ if not st.session_state.authenticated:
                             "authenticated": True,
                             "role": role,
                             "username": username,
-                            "last_request_count": len(get_requests()),
-                            "last_mistake_count": len(get_mistakes()),
-                            "last_message_ids": [msg[0] for msg in get_group_messages()]
+                            "last_request_count": read_counter("requests"),
+                            "last_mistake_count": read_counter("mistakes"),
+                            "chat_windows": {},
+                            "mention_marks": None
                         })
                         st.rerun()
                     else:
@@ -2783,6 +4748,64 @@ if not st.session_state.authenticated:
     st.markdown("</div>", unsafe_allow_html=True)
 
 else:
+    # Events up to here are reflected in this rerun (see live_update_watcher)
+    st.session_state.live_seq = get_event_hub().seq
+    st.session_state.live_rendered_at = monotonic()
+    st.session_state.live_armed = False
+    # Declare this rerun's datasets up front so they load in parallel. The
+    # loaders run on reader threads, so the session values they depend on
+    # are captured here, on the script thread.
+    username = st.session_state.username
+    is_admin = st.session_state.role == "admin"
+    admin_chat_group = st.session_state.get("admin_chat_group")
+    mention_marks = st.session_state.get("mention_marks")
+    chat_windows = st.session_state.setdefault("chat_windows", {})
+    request_board = st.session_state.get("request_board")
+    request_filters = st.session_state.get("request_page_filters")
+
+    def own_group():
+        return next((u.group_name for u in page_data.get("users") if u.username == username), None)
+
+    def load_counters():
+        # Badges: agents see their own group, admins all groups
+        group = None if is_admin else own_group()
+        return {"requests": read_counter("requests"), "mistakes": read_counter("mistakes"),
+                "pending_requests": read_counter("pending_requests", group),
+                "messages": read_counter("messages", group)}
+
+    def load_mentions():
+        if mention_marks is None:
+            return {channel: get_mentions(username, channel, limit=1) for channel in MENTION_CHANNELS.values()}
+        return {channel: get_mentions(username, channel, after_id=mention_marks[channel])
+                for channel in MENTION_CHANNELS.values()}
+
+    def load_chat():
+        group = admin_chat_group if is_admin else own_group()
+        if not group:
+            return None
+        cached = chat_windows.get(group)
+        after_id = cached[1][0].id if cached and cached[1] else 0
+        return (group, after_id) + poll_group_messages(group, after_id)
+
+    page_data = PageData({
+        "users": get_all_users,
+        "counters": load_counters,
+        "mentions": load_mentions,
+        "chat": load_chat,
+        "request_changes": lambda: get_request_changes(request_board["marks"], request_filters[0]),
+        "late_login": get_late_logins,
+        "quality_issues": get_quality_issues,
+        "midshift_issues": get_midshift_issues,
+    })
+    page_data.want("users", "counters", "mentions", "chat")
+    # The board's delta since the cached page (see the requests section)
+    if st.session_state.get("current_section") == "requests" and request_board and not request_filters[3]:
+        page_data.want("request_changes")
+    # Admins (and QA on quality issues) query these by date range instead
+    if st.session_state.get("current_section") in ("late_login", "quality_issues", "midshift_issues") \
+            and st.session_state.role not in ("admin", "qa"):
+        page_data.want(st.session_state.current_section)
+
     if is_killswitch_enabled():
         st.markdown("""
         <div class="killswitch-active">
@@ -2799,33 +4822,77 @@ else:
         """, unsafe_allow_html=True)
 
     def show_notifications():
-        current_requests = get_requests()
-        current_mistakes = get_mistakes()
-        current_messages = get_group_messages()
+        # Totals come from the trigger-maintained counters table
+        counters = page_data.get("counters")
+        request_count = counters["requests"]
+        mistake_count = counters["mistakes"]
         
-        new_requests = len(current_requests) - st.session_state.last_request_count
+        new_requests = request_count - st.session_state.last_request_count
         if new_requests > 0 and st.session_state.last_request_count > 0:
             st.toast(f"📋 {new_requests} new request(s) submitted!")
-        st.session_state.last_request_count = len(current_requests)
+        st.session_state.last_request_count = request_count
         
-        new_mistakes = len(current_mistakes) - st.session_state.last_mistake_count
+        new_mistakes = mistake_count - st.session_state.last_mistake_count
         if new_mistakes > 0 and st.session_state.last_mistake_count > 0:
             st.toast(f"❌ {new_mistakes} new mistake(s) reported!")
-        st.session_state.last_mistake_count = len(current_mistakes)
-        
-        current_message_ids = [msg[0] for msg in current_messages]
-        new_messages = [msg for msg in current_messages if msg[0] not in st.session_state.last_message_ids]
+        st.session_state.last_mistake_count = mistake_count
+        
+        # Mentions of me, in any group or the VIP chat, since the last rerun
+        username = st.session_state.username
+        marks = st.session_state.get("mention_marks")
+        mentions = page_data.get("mentions")
+        mentioned = set()
+        if marks is None:
+            st.session_state.mention_marks = {channel: next((m.id for m in mentions[channel]), 0)
+                                              for channel in MENTION_CHANNELS.values()}
+        else:
+            for channel in MENTION_CHANNELS.values():
+                for msg in reversed(mentions[channel]):
+                    marks[channel] = msg.id
+                    if msg.sender != username:
+                        mentioned.add((channel, msg.id))
+                        st.toast(f"💬 You were mentioned by {msg.sender}!")
+        
+        # Chat: only messages past the session window's newest id are fetched
+        chat = page_data.get("chat")
+        _, new_messages = poll_chat_window(chat[0], prefetched=chat) if chat else ([], [])
         for msg in new_messages:
-            if msg[1] != st.session_state.username:
-                mentions = msg[4].split(',') if msg[4] else []
-                if st.session_state.username in mentions:
-                    st.toast(f"💬 You were mentioned by {msg[1]}!")
-                else:
-                    st.toast(f"💬 New message from {msg[1]}!")
-        st.session_state.last_message_ids = current_message_ids
+            if msg.sender != username and ("group", msg.id) not in mentioned:
+                st.toast(f"💬 New message from {msg.sender}!")
 
     show_notifications()
 
+    # Page section -> hub topic it renders, besides requests, chat and mentions
+    SECTION_TOPICS = {"breaks": "bookings", "late_login": "late_logins",
+                      "quality_issues": "quality_issues", "midshift_issues": "midshift_issues"}
+
+    def live_subscriptions():
+        """(topic, group) pairs this session reruns for; group None follows every group."""
+        username = st.session_state.username
+        if st.session_state.role == "admin":
+            group_name, chat_group = None, st.session_state.get("admin_chat_group")
+        else:
+            group_name = chat_group = next((u.group_name for u in page_data.get("users")
+                                            if u.username == username), None)
+        subscriptions = [("requests", group_name), ("mistakes", None), ("chat", chat_group), ("mentions", username)]
+        if st.session_state.current_section in SECTION_TOPICS:
+            subscriptions.append((SECTION_TOPICS[st.session_state.current_section], None))
+        return subscriptions
+
+    @st.fragment(run_every=LIVE_POLL_SECONDS)
+    def live_update_watcher(subscriptions):
+        """Rerun the page when a subscribed topic has an event, or the fallback is due.
+
+        A quiet tick is a fragment run that only compares the hub's
+        sequence numbers, not a rerun of the whole script.
+        """
+        if not st.session_state.live_armed:
+            st.session_state.live_armed = True  # Called from the full rerun itself
+            return
+        if monotonic() - st.session_state.live_rendered_at >= LIVE_FALLBACK_SECONDS \
+                or get_event_hub().changed(subscriptions, st.session_state.live_seq):
+            st.rerun()
+
     with st.sidebar:
         # Sidebar welcome text color: dark in light mode, white in dark mode
         welcome_color = '#1e293b' if st.session_state.get('color_mode', 'light') == 'light' else '#fff'
@@ -2888,11 +4955,15 @@ else:
         
         # Show notifications only for admin and agent roles
         if st.session_state.role in ["admin", "agent"]:
-            pending_requests = len([r for r in get_requests() if not r[6]])
-            new_mistakes = len(get_mistakes())
-            unread_messages = len([m for m in get_group_messages() 
-                                 if m[0] not in st.session_state.last_message_ids 
-                                 and m[1] != st.session_state.username])
+            # Badges are counter lookups: agents see their own group, admins all
+            counters = page_data.get("counters")
+            pending_requests = counters["pending_requests"]
+            new_mistakes = st.session_state.last_mistake_count
+            # Unread = messages posted since the chat was last open
+            message_count = counters["messages"]
+            if st.session_state.current_section == "chat" or "seen_message_count" not in st.session_state:
+                st.session_state.seen_message_count = message_count
+            unread_messages = max(0, message_count - st.session_state.seen_message_count)
             
             st.markdown(f"""
             <div style="
@@ -2938,51 +5009,15 @@ else:
                             if t:
                                 break_times.append(t)
                     if break_times:
-                        # keep server time fresh without full reload
-                        try:
-                            from streamlit_autorefresh import st_autorefresh  # type: ignore
-                            st_autorefresh(interval=60000, key="agent_autorefresh")
-                        except ImportError:
-                            pass
-                        import streamlit.components.v1 as components
-                        js_break = f"""
-                        <script>
-                        const breakTimes = {json.dumps(break_times)};
-                        const serverTimeISO = '{now_casa.isoformat()}';
-                        const keyPrefix = 'notified_break_sidebar_';
-                        (function() {{
-                            const now = new Date(serverTimeISO);
-                            const today = now.toISOString().split('T')[0];
-                            breakTimes.forEach(bt => {{
-                                const [h,m] = bt.split(':');
-                                const bTime = new Date(now.getFullYear(), now.getMonth(), now.getDate(), h, m, 0);
-                                const diffMin = Math.floor((bTime - now) / 60000);
-                                const storageKey = keyPrefix + today + '_' + bt;
-                                if (diffMin >= 4 && diffMin < 5 && !localStorage.getItem(storageKey)) {{
-                                    const notify = () => new Notification('Break Reminder', {{ body: `Your break starts in 5 minutes at ${{bt}}.` }});
-                                    if (Notification.permission === 'granted') {{
-                                        notify();
-                                        localStorage.setItem(storageKey,'1');
-                                    }} else if (Notification.permission !== 'denied') {{
-                                        Notification.requestPermission().then(p => {{ if (p==='granted') {{ notify(); localStorage.setItem(storageKey,'1'); }} }});
-                                    }}
-                                }}
-                            }});
-                        }})();
-                        </script>
-                        """
-                        components.html(js_break, height=0)
-
-            # --- Auto-update & browser notification for admin when new request is added ---
-            if st.session_state.role == "admin":
-                # Server-side rerun every 15 s keeps data fresh without a full tab reload
-                try:
-                    from streamlit_autorefresh import st_autorefresh  # type: ignore
-                    st_autorefresh(interval=15000, key="admin_autorefresh")
-                except ImportError:
-                    # Package not available – skip (notifications will still work on manual interaction)
-                    pass
+                        # Re-render only the reminder each minute to keep its server time fresh
+                        @st.fragment(run_every=60)
+                        def break_reminder():
+                            render_break_reminder(break_times, datetime.now(morocco_tz))
 
+                        break_reminder()
+
+            # --- Browser notification for admin when new request is added ---
+            if st.session_state.role == "admin":
                 import streamlit.components.v1 as components
                 js_code = f'''
                 <script>
@@ -3020,6 +5055,8 @@ else:
                 components.html(js_code, height=0)
 
 
+        live_update_watcher(live_subscriptions())
+
         if st.button("🚪 Logout", use_container_width=True):
             st.session_state.authenticated = False
             st.rerun()
@@ -3031,14 +5068,14 @@ else:
             # Group selection for admin
             group_filter = None
             if st.session_state.role == "admin":
-                all_groups = list(set([u[3] for u in get_all_users() if u[3]]))
+                all_groups = list(set([u.group_name for u in page_data.get("users") if u.group_name]))
                 group_filter = st.selectbox("Select Group to View Requests", all_groups, key="admin_request_group")
             else:
                 # Set group_name in session_state for agents
                 if not hasattr(st.session_state, 'group_name') or not st.session_state.group_name:
-                    for u in get_all_users():
-                        if u[1] == st.session_state.username:
-                            st.session_state.group_name = u[3]
+                    for u in page_data.get("users"):
+                        if u.username == st.session_state.username:
+                            st.session_state.group_name = u.group_name
                             break
                 group_filter = st.session_state.get('group_name')
             with st.expander("➕ Submit New Request"):
@@ -3052,7 +5089,7 @@ else:
                             # Determine group for request
                             if st.session_state.role == "admin":
                                 # Admins can select any group
-                                all_groups = list(set([u[3] for u in get_all_users() if u[3]]))
+                                all_groups = list(set([u.group_name for u in page_data.get("users") if u.group_name]))
                                 if all_groups:
                                     selected_group = st.selectbox("Assign Request to Group", all_groups, key="admin_request_group_submit")
                                 else:
@@ -3062,9 +5099,9 @@ else:
                             else:
                                 # Agents use their own group
                                 user_group = None
-                                for u in get_all_users():
-                                    if u[1] == st.session_state.username:
-                                        user_group = u[3]
+                                for u in page_data.get("users"):
+                                    if u.username == st.session_state.username:
+                                        user_group = u.group_name
                                         break
                                 group_for_request = user_group
                             if group_for_request:
@@ -3076,57 +5113,142 @@ else:
         
             st.subheader("🔍 Search Requests")
             search_query = st.text_input("Search requests...")
-            # Filter requests by group
-            if st.session_state.role == "admin":
-                # Admin can filter by any group
-                if group_filter:
-                    all_requests = search_requests(search_query) if search_query else get_requests()
-                    requests = [r for r in all_requests if (len(r) > 7 and r[7] == group_filter)]
-                else:
-                    requests = search_requests(search_query) if search_query else get_requests()
+            include_archive = st.checkbox("Include archived requests", key="requests_include_archive") if search_query else False
+            cols = st.columns(2)
+            status_filter = cols[0].selectbox("Status", ["All", "Open", "Done"], key="request_status_filter")
+            page_size = cols[1].selectbox("Requests per page", [25, 50, 100, 200],
+                                          index=[25, 50, 100, 200].index(REQUESTS_PAGE_SIZE), key="request_page_size")
+            status = None if status_filter == "All" else status_filter.lower()
+            # Group and status are filtered in SQL and every page is a keyset
+            # seek from the previous page's last row, so load time does not
+            # grow with the table. Changing any filter starts from page one.
+            filters = (group_filter, status, page_size, search_query, include_archive)
+            if st.session_state.get("request_page_filters") != filters:
+                st.session_state.request_page_filters = filters
+                st.session_state.request_pages = 1
+                st.session_state.request_board = None
+            pages = st.session_state.request_pages
+            comments_by_request = None
+            if st.session_state.role != "admin" and not group_filter:
+                requests, has_more = [], False
+            elif search_query:
+                # Ranked matches are not in board order, so "Load more" widens
+                # the top-N instead of seeking past a cursor.
+                requests = search_requests(search_query, group_name=group_filter, status=status,
+                                           limit=page_size * pages)
+                has_more = len(requests) == page_size * pages
+                # Archived matches follow once the live results run out
+                if include_archive and not has_more:
+                    requests += search_archived_requests(search_query, group_filter, status)
             else:
-                # Agents can only see their own group, regardless of filter
-                user_group = None
-                for u in get_all_users():
-                    if u[1] == st.session_state.username:
-                        user_group = u[3]
-                        break
-                all_requests = search_requests(search_query) if search_query else get_requests()
-                requests = [r for r in all_requests if (len(r) > 7 and r[7] == user_group)]
+                # The loaded pages and their comments are cached in the
+                # session. A rerun only fetches requests changed since the
+                # cached high-water marks (new rows, status toggles, new
+                # comments) and patches them in; "Load more" fetches one page.
+                board = st.session_state.request_board
+                changes = None
+                if board is not None:
+                    # Prefetched with the rerun's other data unless the filters just changed
+                    changes = page_data.get("request_changes") if board is request_board \
+                        else get_request_changes(board["marks"], group_filter)
+                if changes is None:
+                    board = {"marks": request_versions(group_filter), "rows": [], "comments": {},
+                             "pages": 0, "has_more": True}
+                else:
+                    changed, deleted, board["marks"] = changes
+                    if changed or deleted:
+                        board["rows"] = patch_request_page(board["rows"], changed, deleted, status,
+                                                           complete=not board["has_more"])
+                        board["comments"].update(get_comments_for_requests([req.id for req in changed]))
+                while board["pages"] < pages and board["has_more"]:
+                    page = get_requests(group_name=group_filter, status=status, limit=page_size,
+                                        before=board["rows"][-1].cursor if board["rows"] else None)
+                    board["rows"] += page
+                    board["comments"].update(get_comments_for_requests([req.id for req in page]))
+                    board["pages"] += 1
+                    board["has_more"] = len(page) == page_size
+                st.session_state.request_board = board
+                requests, has_more, comments_by_request = board["rows"], board["has_more"], board["comments"]
             
             st.subheader("All Requests")
+            if comments_by_request is None:
+                comments_by_request = get_comments_for_requests([req.id for req in requests])
+            if st.session_state.role == "admin":
+                with st.expander("🎯 Work queue"):
+                    st.caption(f"Claims lapse after {CLAIM_LEASE_SECONDS // 60} minutes unless completed or released.")
+                    if st.button("Claim next request", key="claim_next_request"):
+                        if claim_next_request(st.session_state.username, group_filter) is None:
+                            st.info("No unclaimed open requests in this queue.")
+                        else:
+                            st.rerun()
+                    for claimed in get_claimed_requests(st.session_state.username):
+                        cols = st.columns([0.8, 0.2])
+                        cols[0].markdown(f"**#{claimed.id}** {claimed.request_type} · {claimed.identifier} "
+                                         f"({claimed.group_name})")
+                        if cols[1].button("Release", key=f"release_{claimed.id}"):
+                            release_request(claimed.id, st.session_state.username)
+                            st.rerun()
+            if st.session_state.role == "admin" and requests:
+                # Bulk actions: each runs as one transaction per database
+                # file followed by a single rerun.
+                selected = [req.id for req in requests if st.session_state.get(f"select_{req.id}")]
+                with st.expander(f"🗂️ Bulk actions ({len(selected)} selected)"):
+                    cols = st.columns(2)
+                    if cols[0].button("Select all shown", key="bulk_select_all"):
+                        for req in requests:
+                            st.session_state[f"select_{req.id}"] = True
+                        st.rerun()
+                    if cols[1].button("Clear selection", key="bulk_select_none"):
+                        for req in requests:
+                            st.session_state.pop(f"select_{req.id}", None)
+                        st.rerun()
+                    bulk_comment = st.text_input("Status comment for the selected requests", key="bulk_comment")
+                    cols = st.columns(3)
+                    done = False
+                    if cols[0].button("✅ Mark complete", key="bulk_complete", disabled=not selected):
+                        done = bulk_update_request_status(selected, True)
+                    if cols[1].button("↩️ Reopen", key="bulk_reopen", disabled=not selected):
+                        done = bulk_update_request_status(selected, False)
+                    if cols[2].button("💬 Add comment", key="bulk_add_comment", disabled=not (selected and bulk_comment)):
+                        done = bulk_add_request_comment(selected, st.session_state.username, bulk_comment)
+                    if done:
+                        for req_id in selected:
+                            # Drop the cards' widget state so they re-read the new status
+                            st.session_state.pop(f"select_{req_id}", None)
+                            st.session_state.pop(f"check_{req_id}", None)
+                        st.rerun()
             for req in requests:
-                req_id, agent, req_type, identifier, comment, timestamp, completed, group_name = req
+                req_id = req.id
                 with st.container():
                     cols = st.columns([0.1, 0.9])
                     with cols[0]:
-                        st.checkbox("Done", value=bool(completed), 
+                        st.checkbox("Done", value=bool(req.completed), 
                                    key=f"check_{req_id}", 
                                    on_change=update_request_status,
-                                   args=(req_id, not completed))
+                                   args=(req_id, not req.completed))
+                        if st.session_state.role == "admin":
+                            st.checkbox("Select", key=f"select_{req_id}")
                     with cols[1]:
                         st.markdown(f"""
                         <div class="card">
                             <div style="display: flex; justify-content: space-between;">
-                                <h4>#{req_id} - {req_type}</h4>
-                                <small>{timestamp}</small>
+                                <h4>#{req_id} - {req.request_type}</h4>
+                                <small>{req.timestamp}</small>
                             </div>
-                            <p>Agent: {agent}</p>
-                            <p>Identifier: {identifier}</p>
+                            <p>Agent: {req.agent_name}</p>
+                            <p>Identifier: {req.identifier}</p>{f"<p>🔒 Claimed by {req.active_assignee}</p>" if req.active_assignee else ""}{f"<p><small>Match: {req.snippet}</small></p>" if getattr(req, "snippet", None) else ""}
                             <div style="margin-top: 1rem;">
                                 <h5>Status Updates:</h5>
                         """, unsafe_allow_html=True)
                         
-                        comments = get_request_comments(req_id)
-                        for comment in comments:
-                            cmt_id, _, user, cmt_text, cmt_time = comment
+                        for comment in comments_by_request.get(req_id, []):
                             st.markdown(f"""
                                 <div class="comment-box">
                                     <div class="comment-user">
-                                        <small><strong>{user}</strong></small>
-                                        <small>{cmt_time}</small>
+                                        <small><strong>{comment.user}</strong></small>
+                                        <small>{comment.timestamp}</small>
                                     </div>
-                                    <div class="comment-text">{cmt_text}</div>
+                                    <div class="comment-text">{comment.comment}</div>
                                 </div>
                             """, unsafe_allow_html=True)
                         
@@ -3139,6 +5261,9 @@ else:
                                     if new_comment:
                                         add_request_comment(req_id, st.session_state.username, new_comment)
                                         st.rerun()
+            if has_more and st.button("Load more", key="requests_load_more"):
+                st.session_state.request_pages += 1
+                st.rerun()
         else:
             st.error("System is currently locked. Access to requests is disabled.")
 
@@ -3158,25 +5283,66 @@ else:
                                 st.success("Mistake reported successfully!")
                                 st.rerun()
         
+            if st.session_state.role in ("admin", "qa"):
+                with st.expander("📊 Mistake summary"):
+                    summary_by = st.radio("Group by", ["Agent", "Team leader"], horizontal=True, key="mistake_summary_by")
+                    column = "agent_name" if summary_by == "Agent" else "team_leader"
+                    summary = mistake_summary(column)
+                    if summary:
+                        st.dataframe(pd.DataFrame(summary, columns=[summary_by] + [f"Last {d} days" for d in MISTAKE_SUMMARY_DAYS]),
+                                     use_container_width=True)
+                    else:
+                        st.info(f"No mistakes in the last {MISTAKE_SUMMARY_DAYS[-1]} days.")
+        
             st.subheader("🔍 Search Mistakes")
             search_query = st.text_input("Search mistakes...")
-            mistakes = search_mistakes(search_query) if search_query else get_mistakes()
+            include_archive = st.checkbox("Include archived mistakes", key="mistakes_include_archive") if search_query else False
+            cols = st.columns(4)
+            mistake_agent = cols[0].text_input("Agent", key="mistake_agent_filter").strip()
+            mistake_leader = cols[1].text_input("Team leader", key="mistake_leader_filter").strip()
+            mistake_dates = cols[2].date_input("Date range", value=[], key="mistake_date_filter")
+            mistake_page_size = cols[3].selectbox("Per page", [25, 50, 100, 200],
+                                                  index=[25, 50, 100, 200].index(MISTAKES_PAGE_SIZE), key="mistake_page_size")
+            start_date = mistake_dates[0] if mistake_dates else None
+            end_date = mistake_dates[1] if len(mistake_dates) > 1 else None
+            # Keyset pages like the requests board; any filter change starts over
+            filters = (search_query, include_archive, mistake_agent, mistake_leader, start_date, end_date, mistake_page_size)
+            if st.session_state.get("mistake_page_filters") != filters:
+                st.session_state.mistake_page_filters = filters
+                st.session_state.mistake_page_cursors = [None]
+            mistakes = []
+            for cursor in st.session_state.mistake_page_cursors:
+                if search_query:
+                    last_page = search_mistakes(search_query, agent_name=mistake_agent, team_leader=mistake_leader,
+                                                start_date=start_date, end_date=end_date, before=cursor,
+                                                limit=mistake_page_size)
+                else:
+                    last_page = get_mistakes(agent_name=mistake_agent, team_leader=mistake_leader,
+                                             start_date=start_date, end_date=end_date, before=cursor,
+                                             limit=mistake_page_size)
+                mistakes += last_page
+            has_more = len(last_page) == mistake_page_size
+            # Archived matches are older than every live row
+            if include_archive and not has_more:
+                mistakes += search_archived_mistakes(search_query, mistake_agent, mistake_leader, start_date, end_date)
             
             st.subheader("Mistakes Log")
             for mistake in mistakes:
-                m_id, tl, agent, ticket, error, ts = mistake
                 st.markdown(f"""
                 <div class="card">
                     <div style="display: flex; justify-content: space-between;">
-                        <h4>#{m_id}</h4>
-                        <small>{ts}</small>
+                        <h4>#{mistake.id}</h4>
+                        <small>{mistake.timestamp}</small>
                     </div>
-                    <p>Agent: {agent}</p>
-                    <p>Ticket: {ticket}</p>
-                    <p>Error: {error}</p>
-                    <p><small>Reported by: {tl}</small></p>
+                    <p>Agent: {mistake.agent_name}</p>
+                    <p>Ticket: {mistake.ticket_id}</p>
+                    <p>Error: {mistake.error_description}</p>
+                    <p><small>Reported by: {mistake.team_leader}</small></p>
                 </div>
                 """, unsafe_allow_html=True)
+            if has_more and st.button("Load more", key="mistakes_load_more"):
+                st.session_state.mistake_page_cursors.append(mistakes[-1].cursor)
+                st.rerun()
         else:
             st.error("System is currently locked. Access to mistakes is disabled.")
 
@@ -3216,14 +5382,14 @@ else:
                 # Group chat group selection
                 group_filter = None
                 if st.session_state.role == "admin":
-                    all_groups = list(set([u[3] for u in get_all_users() if u[3]]))
+                    all_groups = list(set([u.group_name for u in page_data.get("users") if u.group_name]))
                     group_filter = st.selectbox("Select Group to View Chat", all_groups, key="admin_chat_group")
                 else:
                     # Always look up the user's group from the users table each time
                     user_group = None
-                    for u in get_all_users():
-                        if u[1] == st.session_state.username:
-                            user_group = u[3]
+                    for u in page_data.get("users"):
+                        if u.username == st.session_state.username:
+                            user_group = u.group_name
                             break
                     st.session_state.group_name = user_group
                     group_filter = user_group
@@ -3236,14 +5402,14 @@ else:
                 else:
                     # Agents always see only their group (look up each time)
                     user_group = None
-                    for u in get_all_users():
-                        if u[1] == st.session_state.username:
-                            user_group = u[3]
+                    for u in page_data.get("users"):
+                        if u.username == st.session_state.username:
+                            user_group = u.group_name
                             break
                     view_group = user_group
                 # Harden: never allow None or empty group to fetch all messages
                 if view_group is not None and str(view_group).strip() != "":
-                    messages = get_group_messages(view_group)
+                    messages, _ = poll_chat_window(view_group)
                 else:
                     messages = []  # No group selected or group is blank, show no messages
                     if st.session_state.role == "agent":
@@ -3257,40 +5423,40 @@ else:
                 .chat-message.sent .message-content {background: #dbeafe;}
                 .chat-message .message-meta {font-size: 0.8rem; color: #64748b; margin-top: 2px;}
                 </style>''', unsafe_allow_html=True)
+                # Messages older than ARCHIVE_AFTER_DAYS live in the monthly archives
+                if view_group and st.checkbox("📦 Show archived history", key="chat_show_archive"):
+                    archived = get_archived_group_messages(view_group)
+                    for msg in reversed(archived):
+                        st.caption(f"{msg.sender} • {msg.timestamp}")
+                        st.text(msg.message)
+                    if not archived:
+                        st.caption("No archived messages for this group.")
                 st.markdown('<div class="chat-container">', unsafe_allow_html=True)
-                # Chat message rendering
+                # Chat message rendering; reactions for the whole window in one query
+                reactions = get_reaction_counts([msg.id for msg in messages], st.session_state.username)
                 for msg in reversed(messages):
-                    # Unpack all 7 fields (id, sender, message, ts, mentions, group_name, reactions)
-                    if isinstance(msg, dict):
-                        msg_id = msg.get('id')
-                        sender = msg.get('sender')
-                        message = msg.get('message')
-                        ts = msg.get('timestamp')
-                        mentions = msg.get('mentions')
-                        group_name = msg.get('group_name')
-                        reactions = msg.get('reactions', {})
-                    else:
-                        # fallback for tuple
-                        if len(msg) == 7:
-                            msg_id, sender, message, ts, mentions, group_name, reactions = msg
-                            try:
-                                reactions = json.loads(reactions) if reactions else {}
-                            except Exception:
-                                reactions = {}
-                        else:
-                            msg_id, sender, message, ts, mentions, group_name = msg
-                            reactions = {}
-                    is_sent = sender == st.session_state.username
+                    is_sent = msg.sender == st.session_state.username
+                    reaction_line = " ".join(f"<b>{emoji} {count}</b>" if mine else f"{emoji} {count}"
+                                             for emoji, count, mine in reactions.get(msg.id, []))
                     st.markdown(f"""
                     <div class="chat-message {'sent' if is_sent else 'received'}">
-                        <div class="message-avatar">{sender[0].upper()}</div>
+                        <div class="message-avatar">{msg.sender[0].upper()}</div>
                         <div class="message-content">
-                            <div>{message}</div>
-                            <div class="message-meta">{sender} • {ts}</div>
+                            <div>{msg.message}</div>
+                            <div class="message-meta">{msg.sender} • {msg.timestamp}{" • " + reaction_line if reaction_line else ""}</div>
                         </div>
                     </div>
                     """, unsafe_allow_html=True)
                 st.markdown('</div>', unsafe_allow_html=True)
+                if messages:
+                    with st.form("reaction_form"):
+                        cols = st.columns([4, 2, 1])
+                        react_to = cols[0].selectbox("React to", messages[:10], key="reaction_message",
+                                                     format_func=lambda m: f"{m.sender}: {m.message[:40]}")
+                        emoji = cols[1].selectbox("Reaction", ["👍", "❤️", "😂", "✅", "👀"], key="reaction_emoji")
+                        if cols[2].form_submit_button("React"):
+                            add_reaction_to_message(react_to.id, emoji, st.session_state.username)
+                            st.rerun()
 
                 # Chat input form (no emoji picker)
                 with st.form("chat_form", clear_on_submit=True):
@@ -3305,9 +5471,9 @@ else:
                                 else:
                                     # Always look up the user's group from the users table
                                     send_to_group = None
-                                    for u in get_all_users():
-                                        if u[1] == st.session_state.username:
-                                            send_to_group = u[3]
+                                    for u in page_data.get("users"):
+                                        if u.username == st.session_state.username:
+                                            send_to_group = u.group_name
                                             break
                                 if send_to_group:
                                     send_group_message(st.session_state.username, message, send_to_group)
@@ -3324,37 +5490,26 @@ else:
             # --- HOLD Table Functions (now using SQLite for persistence) ---
             import io
             def add_hold_table(uploader, table_data):
-                conn = get_db_connection()
-                try:
+                with db_transaction("hold_tables") as conn:
                     cursor = conn.cursor()
                     # Only keep the latest table: clear any existing records
                     cursor.execute("DELETE FROM hold_tables")
                     timestamp = get_casablanca_time()  # Ensure Casablanca time
                     cursor.execute("INSERT INTO hold_tables (uploader, table_data, timestamp) VALUES (?, ?, ?)", (uploader, table_data, timestamp))
-                    conn.commit()
                     return True
-                finally:
-                    conn.close()
 
             def get_hold_tables():
                 conn = get_db_connection()
-                try:
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT id, uploader, table_data, timestamp FROM hold_tables ORDER BY id DESC LIMIT 1")
-                    result = cursor.fetchall()
-                    return result
-                finally:
-                    conn.close()
+                cursor = conn.cursor()
+                cursor.execute("SELECT id, uploader, table_data, timestamp FROM hold_tables ORDER BY id DESC LIMIT 1")
+                result = cursor.fetchall()
+                return result
 
             def clear_hold_tables():
-                conn = get_db_connection()
-                try:
+                with db_transaction("hold_tables") as conn:
                     cursor = conn.cursor()
                     cursor.execute("DELETE FROM hold_tables")
-                    conn.commit()
                     return True
-                finally:
-                    conn.close()
             # --- END HOLD Table Functions ---
             # Only show table paste option to admin users
             if st.session_state.role == "admin":
@@ -3443,14 +5598,14 @@ else:
                             st.session_state.username,
                             presence_time,
                             login_time,
-                            reason
+                            reason,
+                            wait=False
                         )
                         st.success("Late login reported successfully!")
                     except ValueError:
                         st.error("Invalid time format. Please use HH:MM format (e.g., 08:30)")
         
         st.subheader("Late Login Records")
-        late_logins = get_late_logins()
         
         if st.session_state.role == "admin":
             # Search and date filter only for admin users
@@ -3461,42 +5616,22 @@ else:
                 start_date = st.date_input("Start date", key="late_login_start_date")
                 end_date = st.date_input("End date", key="late_login_end_date")
 
-            # Filtering logic
-            if search_query or start_date or end_date:
-                filtered_logins = []
-                for login in late_logins:
-                    matches_search = True
-                    matches_date = True
-                    
-                    if search_query:
-                        matches_search = (
-                            search_query.lower() in login[1].lower() or  # Agent name
-                            search_query.lower() in login[4].lower() or  # Reason
-                            search_query in login[2] or  # Presence time
-                            search_query in login[3]     # Login time
-                        )
-                    
-                    if start_date and end_date:
-                        try:
-                            record_date = datetime.strptime(login[5], "%Y-%m-%d %H:%M:%S").date()
-                            matches_date = start_date <= record_date <= end_date
-                        except:
-                            matches_date = False
-                    elif start_date:
-                        try:
-                            record_date = datetime.strptime(login[5], "%Y-%m-%d %H:%M:%S").date()
-                            matches_date = record_date == start_date
-                        except:
-                            matches_date = False
-                    # else: no date filter
-                    if matches_search and matches_date:
-                        filtered_logins.append(login)
-                late_logins = filtered_logins
+            # Date range is a SQL range scan on ts_epoch; the text search
+            # only filters the rows for the selected days.
+            late_logins = get_late_logins(start_date=start_date, end_date=end_date) if start_date else page_data.get("late_login")
+            if search_query:
+                late_logins = [
+                    login for login in late_logins
+                    if search_query.lower() in login.agent_name.lower() or
+                    search_query.lower() in login.reason.lower() or
+                    search_query in login.presence_time or
+                    search_query in login.login_time
+                ]
             
             if late_logins:
                 data = []
                 for login in late_logins:
-                    _, agent, presence, login_time, reason, ts = login
+                    agent, presence, login_time, reason, ts = login.agent_name, login.presence_time, login.login_time, login.reason, login.timestamp
                     data.append({
                         "Agent's Name": agent,
                         "Time of presence": presence,
@@ -3543,11 +5678,11 @@ else:
                 st.info("No late login records found")
         else:
             # Regular users only see their own records without search
-            user_logins = [login for login in late_logins if login[1] == st.session_state.username]
+            user_logins = [login for login in page_data.get("late_login") if login.agent_name == st.session_state.username]
             if user_logins:
                 data = []
                 for login in user_logins:
-                    _, agent, presence, login_time, reason, ts = login
+                    agent, presence, login_time, reason, ts = login.agent_name, login.presence_time, login.login_time, login.reason, login.timestamp
                     data.append({
                         "Time of presence": presence,
                         "Time of log in": login_time,
@@ -3602,14 +5737,14 @@ else:
                             issue_type,
                             timing,
                             mobile_number,
-                            product
+                            product,
+                            wait=False
                         )
                         st.success("Quality issue reported successfully!")
                     except ValueError:
                         st.error("Invalid time format. Please use HH:MM format (e.g., 14:30)")
         
         st.subheader("Quality Issue Records")
-        quality_issues = get_quality_issues()
         
         # Allow both admin and QA roles to see all records and use search/filter
         if st.session_state.role in ["admin", "qa"]:
@@ -3621,43 +5756,23 @@ else:
                 start_date = st.date_input("Start date", key="quality_issues_start_date")
                 end_date = st.date_input("End date", key="quality_issues_end_date")
 
-            # Filtering logic
-            if search_query or start_date or end_date:
-                filtered_issues = []
-                for issue in quality_issues:
-                    matches_search = True
-                    matches_date = True
-                    
-                    if search_query:
-                        matches_search = (
-                            search_query.lower() in issue[1].lower() or  # Agent name
-                            search_query.lower() in issue[2].lower() or  # Issue type
-                            search_query in issue[3] or  # Timing
-                            search_query in issue[4] or  # Mobile number
-                            search_query.lower() in issue[5].lower()  # Product
-                        )
-                    
-                    if start_date and end_date:
-                        try:
-                            record_date = datetime.strptime(issue[6], "%Y-%m-%d %H:%M:%S").date()
-                            matches_date = start_date <= record_date <= end_date
-                        except:
-                            matches_date = False
-                    elif start_date:
-                        try:
-                            record_date = datetime.strptime(issue[6], "%Y-%m-%d %H:%M:%S").date()
-                            matches_date = record_date == start_date
-                        except:
-                            matches_date = False
-                    # else: no date filter
-                    if matches_search and matches_date:
-                        filtered_issues.append(issue)
-                quality_issues = filtered_issues
+            # Date range is a SQL range scan on ts_epoch; the text search
+            # only filters the rows for the selected days.
+            quality_issues = get_quality_issues(start_date=start_date, end_date=end_date) if start_date else page_data.get("quality_issues")
+            if search_query:
+                quality_issues = [
+                    issue for issue in quality_issues
+                    if search_query.lower() in issue.agent_name.lower() or
+                    search_query.lower() in issue.issue_type.lower() or
+                    search_query in issue.timing or
+                    search_query in issue.mobile_number or
+                    search_query.lower() in issue.product.lower()
+                ]
             
             if quality_issues:
                 data = []
                 for issue in quality_issues:
-                    _, agent, issue_type, timing, mobile, product, ts = issue
+                    agent, issue_type, timing, mobile, product, ts = issue.agent_name, issue.issue_type, issue.timing, issue.mobile_number, issue.product, issue.timestamp
                     data.append({
                         "Agent's Name": agent,
                         "Type of issue": issue_type,
@@ -3707,11 +5822,11 @@ else:
                 st.info("No quality issue records found")
         else:
             # Regular users only see their own records without search
-            user_issues = [issue for issue in quality_issues if issue[1] == st.session_state.username]
+            user_issues = [issue for issue in page_data.get("quality_issues") if issue.agent_name == st.session_state.username]
             if user_issues:
                 data = []
                 for issue in user_issues:
-                    _, agent, issue_type, timing, mobile, product, ts = issue
+                    agent, issue_type, timing, mobile, product, ts = issue.agent_name, issue.issue_type, issue.timing, issue.mobile_number, issue.product, issue.timestamp
                     data.append({
                         "Type of issue": issue_type,
                         "Timing": timing,
@@ -3750,14 +5865,14 @@ else:
                             st.session_state.username,
                             issue_type,
                             start_time,
-                            end_time
+                            end_time,
+                            wait=False
                         )
                         st.success("Mid-shift issue reported successfully!")
                     except ValueError:
                         st.error("Invalid time format. Please use HH:MM format (e.g., 10:00)")
         
         st.subheader("Mid-shift Issue Records")
-        midshift_issues = get_midshift_issues()
         
         if st.session_state.role == "admin":
             # Search and date filter only for admin users
@@ -3768,42 +5883,22 @@ else:
                 start_date = st.date_input("Start date", key="midshift_issues_start_date")
                 end_date = st.date_input("End date", key="midshift_issues_end_date")
 
-            # Filtering logic
-            if search_query or start_date or end_date:
-                filtered_issues = []
-                for issue in midshift_issues:
-                    matches_search = True
-                    matches_date = True
-                    
-                    if search_query:
-                        matches_search = (
-                            search_query.lower() in issue[1].lower() or  # Agent name
-                            search_query.lower() in issue[2].lower() or  # Issue type
-                            search_query in issue[3] or  # Start time
-                            search_query in issue[4]     # End time
-                        )
-                    
-                    if start_date and end_date:
-                        try:
-                            record_date = datetime.strptime(issue[5], "%Y-%m-%d %H:%M:%S").date()
-                            matches_date = start_date <= record_date <= end_date
-                        except:
-                            matches_date = False
-                    elif start_date:
-                        try:
-                            record_date = datetime.strptime(issue[5], "%Y-%m-%d %H:%M:%S").date()
-                            matches_date = record_date == start_date
-                        except:
-                            matches_date = False
-                    # else: no date filter
-                    if matches_search and matches_date:
-                        filtered_issues.append(issue)
-                midshift_issues = filtered_issues
+            # Date range is a SQL range scan on ts_epoch; the text search
+            # only filters the rows for the selected days.
+            midshift_issues = get_midshift_issues(start_date=start_date, end_date=end_date) if start_date else page_data.get("midshift_issues")
+            if search_query:
+                midshift_issues = [
+                    issue for issue in midshift_issues
+                    if search_query.lower() in issue.agent_name.lower() or
+                    search_query.lower() in issue.issue_type.lower() or
+                    search_query in issue.start_time or
+                    search_query in issue.end_time
+                ]
             
             if midshift_issues:
                 data = []
                 for issue in midshift_issues:
-                    _, agent, issue_type, start_time, end_time, ts = issue
+                    agent, issue_type, start_time, end_time, ts = issue.agent_name, issue.issue_type, issue.start_time, issue.end_time, issue.timestamp
                     data.append({
                         "Agent's Name": agent,
                         "Issue Type": issue_type,
@@ -3850,11 +5945,11 @@ else:
                 st.info("No mid-shift issue records found")
         else:
             # Regular users only see their own records without search
-            user_issues = [issue for issue in midshift_issues if issue[1] == st.session_state.username]
+            user_issues = [issue for issue in page_data.get("midshift_issues") if issue.agent_name == st.session_state.username]
             if user_issues:
                 data = []
                 for issue in user_issues:
-                    _, agent, issue_type, start_time, end_time, ts = issue
+                    agent, issue_type, start_time, end_time, ts = issue.agent_name, issue.issue_type, issue.start_time, issue.end_time, issue.timestamp
                     data.append({
                         "Issue Type": issue_type,
                         "Start time": start_time,
@@ -3919,6 +6014,122 @@ else:
             
             st.markdown("---")
         
+        st.subheader("🗄️ Database Connections")
+        pool = get_connection_pool()
+        pool_stats = pool.stats()
+        cols = st.columns(3)
+        cols[0].metric("Open connections", pool_stats["open"])
+        cols[1].metric("Opened since start", pool_stats["opened"])
+        cols[2].metric("Reused", pool_stats["reused"])
+        
+        st.write(f"Storage mode: **{pool.journal_mode}** (busy timeout {DB_BUSY_TIMEOUT_MS} ms)")
+        if pool.checkpointer is not None:
+            wal_stats = pool.checkpointer.stats()
+            st.write(
+                f"WAL size: {wal_stats['wal_bytes'] / 1024:.0f} KB • "
+                f"Checkpoints: {wal_stats['runs']} ({wal_stats['truncations']} truncating) • "
+                f"Last checkpoint: {wal_stats['last_run'] or 'not yet'}"
+            )
+        contention = pool.contention_stats()
+        if contention:
+            st.write("Write contention by table:")
+            st.dataframe(pd.DataFrame([
+                {
+                    "Table": table,
+                    "Transactions": entry["transactions"],
+                    "Lock waits": entry["lock_waits"],
+                    "Avg wait (ms)": round(entry["wait_ms"] / entry["lock_waits"], 1) if entry["lock_waits"] else 0,
+                    "Max wait (ms)": round(entry["max_wait_ms"], 1),
+                    "Retries": entry["retries"],
+                    "Failures": entry["failures"],
+                }
+                for table, entry in sorted(contention.items())
+            ]), use_container_width=True)
+        writer_stats = get_write_queue().stats()
+        st.write(
+            f"Write queue: {writer_stats['pending']} pending • {writer_stats['writes']} writes in "
+            f"{writer_stats['batches']} commits (avg {writer_stats['avg_batch']}, "
+            f"max {writer_stats['largest_batch']} per commit) • {writer_stats['failures']} failed"
+        )
+        if writer_stats["last_error"]:
+            st.caption(f"Last write error: {writer_stats['last_error']}")
+        if shard_router is not None:
+            shard_rows = []
+            for shard in shard_router.shards():
+                shard_writer_stats = shard.writer.stats()
+                shard_rows.append({
+                    "Group": shard.group_name,
+                    "File": shard.pool.path,
+                    "Open connections": shard.pool.stats()["open"],
+                    "Writes": shard_writer_stats["writes"],
+                    "Commits": shard_writer_stats["batches"],
+                    "Pending": shard_writer_stats["pending"],
+                })
+            st.write(f"Sharding: {len(shard_rows)} group shard(s)")
+            if shard_rows:
+                st.dataframe(pd.DataFrame(shard_rows), use_container_width=True)
+        if st.button("Check query plans"):
+            plan_problems = check_query_plans()
+            if plan_problems:
+                st.error(f"{len(plan_problems)} query plan problem(s) found")
+                st.dataframe(pd.DataFrame(plan_problems, columns=["Query", "SQL", "Plan"]), use_container_width=True)
+            else:
+                st.success("Every probed query uses an index.")
+        
+        st.markdown("---")
+        
+        st.subheader("📦 Archive")
+        archiver = get_archiver()
+        if archiver is not None:
+            moved_summary = ", ".join(f"{table}: {count}" for table, count in sorted(archiver.last_moved.items())) or "nothing to move"
+            st.write(f"Rolling archival every {ARCHIVE_INTERVAL_HOURS:g} h • last run: {archiver.last_run or 'not yet'} ({moved_summary})")
+            if archiver.last_error:
+                st.caption(f"Last archival error: {archiver.last_error}")
+        archives = archive_stats()
+        if archives:
+            st.dataframe(pd.DataFrame(
+                [{"Month": month, "Size (KB)": round(size / 1024)} for month, size in archives]
+            ), use_container_width=True)
+        with st.form("archive_form"):
+            archive_days = st.number_input("Archive rows older than (days)", min_value=1, value=ARCHIVE_AFTER_DAYS)
+            if st.form_submit_button("Archive Now"):
+                moved = archive_old_rows(int(archive_days))
+                if moved:
+                    st.success("Archived " + ", ".join(f"{count} {table}" for table, count in sorted(moved.items())))
+                else:
+                    st.info("No rows old enough to archive.")
+        
+        st.markdown("---")
+        
+        st.subheader("📥 Import Requests")
+        st.caption("CSV columns: " + ", ".join(IMPORT_COLUMNS) + " (group_name and timestamp optional)")
+        with st.form("import_requests_form"):
+            import_file = st.file_uploader("Requests CSV", type=["csv"])
+            import_groups = sorted({u.group_name for u in get_all_users() if u.group_name})
+            import_group = st.selectbox("Group for rows without group_name", [""] + import_groups)
+            if st.form_submit_button("Import") and import_file is not None:
+                os.makedirs(IMPORT_DIR, exist_ok=True)
+                reject_path = os.path.join(IMPORT_DIR, f"rejects-{datetime.now().strftime('%Y%m%d-%H%M%S')}.csv")
+                import_status = st.empty()
+                with open(reject_path, "w", newline="", encoding="utf-8") as reject_file:
+                    result = import_requests_csv(
+                        io.TextIOWrapper(import_file, encoding="utf-8-sig", newline=""), reject_file,
+                        group_name=import_group or None,
+                        progress=lambda imported, rejected: import_status.write(f"{imported} imported, {rejected} rejected…"))
+                if result:
+                    import_status.success(f"Imported {result['imported']} request(s) in {result['seconds']:.1f}s "
+                                   f"({result['rows_per_second']:.0f} rows/s)")
+                    if result["rejected"]:
+                        st.session_state.import_rejects = reject_path
+                    else:
+                        os.remove(reject_path)
+        if st.session_state.get("import_rejects") and os.path.exists(st.session_state.import_rejects):
+            with open(st.session_state.import_rejects, "rb") as f:
+                st.download_button("Download rejected rows", f.read(),
+                                   file_name=os.path.basename(st.session_state.import_rejects), mime="text/csv")
+        
+        st.markdown("---")
+        
         st.subheader("🧹 Data Management")
         
         with st.form("data_clear_form"):
@@ -3999,7 +6210,7 @@ else:
                     st.info("Note: New accounts will be created as agent accounts.")
                 # --- Group selection for all new users ---
                 # Fetch all groups from users table
-                all_groups = list(set([u[3] for u in get_all_users() if u[3]]))
+                all_groups = list(set([u.group_name for u in page_data.get("users") if u.group_name]))
                 group_choice = None
                 group_name = None
                 if all_groups:
@@ -4078,7 +6289,7 @@ else:
         if st.session_state.role == "admin":
             st.write("### Reset User Password")
             with st.form("reset_password_form"):
-                reset_user = st.selectbox("Select User", [u[1] for u in users], key="reset_user_select")
+                reset_user = st.selectbox("Select User", [u.username for u in users], key="reset_user_select")
                 new_pwd = st.text_input("New Password", type="password", key="reset_user_pwd")
                 if st.form_submit_button("Reset Password"):
                     def is_password_complex(password):
@@ -4109,12 +6320,12 @@ else:
             
             # Create a dataframe for better display
             user_data = []
-            for uid, uname, urole, gname in users:
+            for user in users:
                 user_data.append({
-                    "ID": uid,
-                    "Username": uname,
-                    "Role": urole,
-                    "Group": gname
+                    "ID": user.id,
+                    "Username": user.username,
+                    "Role": user.role,
+                    "Group": user.group_name
                 })
             
             df = pd.DataFrame(user_data)
@@ -4127,7 +6338,7 @@ else:
                     st.write("### Delete User")
                     user_to_delete = st.selectbox(
                         "Select User to Delete",
-                        [f"{user[0]} - {user[1]} ({user[2]})" for user in users],
+                        [f"{user.id} - {user.username} ({user.role})" for user in users],
                         key="delete_user_select"
                     )
                     
@@ -4145,15 +6356,15 @@ else:
         
         with user_tabs[1]:
             # Admins view
-            admin_users = [user for user in users if user[2] == "admin"]
+            admin_users = [user for user in users if user.role == "admin"]
             st.write(f"### Admin Users ({len(admin_users)})")
             
             admin_data = []
-            for uid, uname, urole, gname in admin_users:
+            for user in admin_users:
                 admin_data.append({
-                    "ID": uid,
-                    "Username": uname,
-                    "Group": gname
+                    "ID": user.id,
+                    "Username": user.username,
+                    "Group": user.group_name
                 })
             
             if admin_data:
@@ -4163,13 +6374,13 @@ else:
         
         with user_tabs[2]:
             # Agents view
-            agent_users = [user for user in users if user[2] == "agent"]
+            agent_users = [user for user in users if user.role == "agent"]
             st.write(f"### Agent Users ({len(agent_users)})")
 
             # --- Admin: Show agent to template assignments ---
             if st.session_state.role == "admin":
                 st.subheader("Agent Break Template Assignments")
-                agent_templates = get_all_users(include_templates=True)
+                agent_templates = get_all_users()
                 templates_list = []
                 try:
                     with open("templates.json", "r") as f:
@@ -4178,7 +6389,7 @@ else:
                     st.warning("No break templates found. Please add templates.json.")
 
                 # --- Refactored: Single agent dropdown ---
-                agent_choices = [(u[1], u[3]) for u in agent_templates if u[2] == "agent"]
+                agent_choices = [(u.username, u.group_name) for u in agent_templates if u.role == "agent"]
                 agent_labels = [f"{name} ({group})" if group else name for name, group in agent_choices]
                 agent_usernames = [name for name, _ in agent_choices]
                 if not agent_labels:
@@ -4188,8 +6399,8 @@ else:
                     if selected_idx is not None:
                         username = agent_usernames[selected_idx]
                         # Get current templates
-                        agent_row = next(u for u in agent_templates if u[1] == username)
-                        current_templates = [t.strip() for t in (agent_row[4] or '').split(',') if t.strip()]
+                        agent_row = next(u for u in agent_templates if u.username == username)
+                        current_templates = agent_row.template_list
                         st.write(f"**Editing templates for:** {username}")
                         new_templates = st.multiselect(
                             f"Edit templates for {username}",
@@ -4199,7 +6410,7 @@ else:
                         )
 
                         # --- Group selection for agent ---
-                        all_groups = list(set([u[3] for u in get_all_users() if u[3]]))
+                        all_groups = list(set([u.group_name for u in page_data.get("users") if u.group_name]))
                         group_choice = None
                         group_name = None
                         if all_groups:
@@ -4216,18 +6427,14 @@ else:
 
                         if st.button(f"Save for {username}", key=f"save_templates_{username}"):
                             def update_agent_templates_and_group(username, templates, group_name):
-                                conn = sqlite3.connect("data/requests.db")
-                                try:
+                                with db_transaction("users") as conn:
                                     cursor = conn.cursor()
                                     templates_str = ','.join(templates)
                                     cursor.execute(
                                         "UPDATE users SET break_templates = ?, group_name = ? WHERE username = ?",
                                         (templates_str, group_name, username)
                                     )
-                                    conn.commit()
                                     return True
-                                finally:
-                                    conn.close()
                             if group_choice == "Create new group" and not group_name:
                                 st.error("Please enter a new group name.")
                             else:
@@ -4238,11 +6445,11 @@ else:
 
             
             agent_data = []
-            for uid, uname, urole, gname in agent_users:
+            for user in agent_users:
                 agent_data.append({
-                    "ID": uid,
-                    "Username": uname,
-                    "Group": gname
+                    "ID": user.id,
+                    "Username": user.username,
+                    "Group": user.group_name
                 })
             
             if agent_data:
@@ -4252,7 +6459,7 @@ else:
                     st.write("### Delete Agent")
                     agent_to_delete = st.selectbox(
                         "Select Agent to Delete",
-                        [f"{user[0]} - {user[1]}" for user in agent_users],
+                        [f"{user.id} - {user.username}" for user in agent_users],
                         key="delete_agent_select"
                     )
                     
@@ -4267,15 +6474,15 @@ else:
         
         with user_tabs[3]:
             # QA view
-            qa_users = [user for user in users if user[2] == "qa"]
+            qa_users = [user for user in users if user.role == "qa"]
             st.write(f"### QA Users ({len(qa_users)})")
             
             qa_data = []
-            for uid, uname, urole, gname in qa_users:
+            for user in qa_users:
                 qa_data.append({
-                    "ID": uid,
-                    "Username": uname,
-                    "Group": gname
+                    "ID": user.id,
+                    "Username": user.username,
+                    "Group": user.group_name
                 })
             
             if qa_data:
@@ -4377,24 +6584,6 @@ else:
                 color = "green" if result == "PASS" else "red"
                 st.write(f"<span style='color:{color}'>{number[-6:]}: {result} ({pattern})</span>", unsafe_allow_html=True)
 
-def get_new_messages(last_check_time, group_name=None):
-    """Get new messages since last check for the specified group only."""
-    # Never allow None, empty, or blank group_name to fetch all messages
-    if group_name is None or str(group_name).strip() == "":
-        return []
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id, sender, message, timestamp, mentions, group_name
-            FROM group_messages
-            WHERE timestamp > ? AND group_name = ?
-            ORDER BY timestamp DESC
-        """, (last_check_time, group_name))
-        return cursor.fetchall()
-    finally:
-        conn.close()
-
 def handle_message_check():
     if not st.session_state.authenticated:
         return {"new_messages": False, "messages": []}
@@ -4418,14 +6607,12 @@ def handle_message_check():
     if new_messages:
         messages_data = []
         for msg in new_messages:
-            # Now msg includes group_name as last field
-            msg_id, sender, message, ts, mentions, _group_name = msg
-            if sender != st.session_state.username:  # Don't notify about own messages
-                mentions_list = mentions.split(',') if mentions else []
-                if st.session_state.username in mentions_list:
+            if msg.sender != st.session_state.username:  # Don't notify about own messages
+                message = msg.message
+                if st.session_state.username in msg.mention_list:
                     message = f"@{st.session_state.username} {message}"
                 messages_data.append({
-                    "sender": sender,
+                    "sender": msg.sender,
                     "message": message
                 })
         return {"new_messages": bool(messages_data), "messages": messages_data}
@@ -0,0 +1,24 @@
+"""Query plan regression check against a freshly migrated database."""
+import os
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "USA FORM (1).py")
+
+
+def load_data_layer():
+    """Run the app's data layer (everything above the Streamlit App banner)."""
+    with open(APP, encoding="utf-8") as f:
+        source = f.read()
+    cut = source.rindex("# ----", 0, source.index("# Streamlit App"))
+    namespace = {"__name__": "usa_form", "__file__": APP}
+    exec(compile(source[:cut], APP, "exec"), namespace)
+    return namespace
+
+
+def test_no_query_scans_or_sorts(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    app = load_data_layer()
+    app["init_db"]()
+    # One request moves the delta feed's version so get_request_changes
+    # runs its row_version range query instead of returning early.
+    app["add_request"]("probe", "Email", "probe@example.com", "probe")
+    assert app["check_query_plans"]() == []